@@ -5,15 +5,16 @@ import sys
 import os
 import json
 
-from simple_term_menu import TerminalMenu
 from rich import print
 from rich_argparse import RichHelpFormatter
 
 from .setup_tools import setup_magicbook_library
 from .library_tools import audit_library, add_new_chart
-from .book_tools import assemble_books
+from .index_tools import update_index, open_index, chart_page_counts
+from .book_tools import assemble_books, build_plan
 # from book_tools import Instrument
-from .imposition_tools import merge_marchpacks
+# imposition_tools pulls in pypdf and reportlab, so it is only imported by
+# the commands that impose books (see startup_benchmark)
 from .simple_io_tools import (
     assemble_book_questions,
     impose_choose_book,
@@ -28,7 +29,8 @@ from .constants import (
     DEFAULT_CONFIG,
     SPLITSORT,
     MARCHPACK_FORMATS,
-    BINDER_FORMATS
+    BINDER_FORMATS,
+    TRIM_GUIDES_FILENAME
 )
 
 
@@ -76,6 +78,9 @@ def interactive_mode():
     A fully interactive mode to run magicbook, in the style of an 80s text
     adventure game, that doesn't require the user to pass any arguments.
     """
+    from simple_term_menu import TerminalMenu
+    from .imposition_tools import merge_marchpacks
+
     CONFIG_DIR = './config/'
     config = load_config(CONFIG_DIR)
 
@@ -238,6 +243,30 @@ def main():
         default="."
     )
 
+    parser.add_argument(
+        "--full-audit",
+        action="store_true",
+        help="Validate every chart, ignoring the library's audit cache"
+    )
+
+    parser.add_argument(
+        "--audit-jobs",
+        type=int,
+        default=1,
+        metavar="N",
+        help="Number of charts to audit in parallel"
+    )
+
+    parser.add_argument(
+        "--audit-pool",
+        choices=["thread", "process"],
+        default="thread",
+        help=(
+            "Audit charts with a thread pool (libraries on a network share) "
+            "or a process pool (CPU-bound validation)"
+        )
+    )
+
     sub_parsers = parser.add_subparsers(dest='cmd')
 
     sub_parsers.add_parser(
@@ -292,6 +321,28 @@ def main():
         metavar=("TITLE", "COMPOSER", "ARRANGER")
     )
 
+    index_parser = sub_parsers.add_parser(
+        "index",
+        help="Commands for managing the library index",
+        formatter_class=RichHelpFormatter
+    )
+    index_commands = index_parser.add_subparsers(
+        dest='index_cmd',
+        title='Library Index',
+        description=(
+            'Commands for building the index of charts and parts, used to '
+            'find parts and page counts without reading the whole library'
+        ),
+    )
+    index_commands.add_parser(
+        "rebuild",
+        help="Discards the library index and indexes every part again"
+    )
+    index_commands.add_parser(
+        "update",
+        help="Indexes new and changed parts, and removes deleted parts"
+    )
+
     books_parser = sub_parsers.add_parser(
         "books",
         help="Commands for building and imposing books",
@@ -309,10 +360,29 @@ def main():
         "list",
         help="Lists all books in the library"
     )
-    books_commands.add_parser(
+    build_book = books_commands.add_parser(
         "build",
         help="Builds a new book"
     )
+    build_book.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=1,
+        metavar="N",
+        help="Number of parts to stage in parallel"
+    )
+    build_book.add_argument(
+        "--plan",
+        type=str,
+        nargs="?",
+        const="-",
+        metavar="FILE",
+        help=(
+            "Print the assembly plan as JSON (or save it to FILE) "
+            "without building the books"
+        )
+    )
     impose_book = books_commands.add_parser(
         "impose",
         help="Imposes a book for printing in a specified format"
@@ -331,7 +401,18 @@ def main():
         "--print-format",
         type=str,
         action="store",
-        help="Specify the format to impose the book into"
+        help=(
+            "Specify the format to impose the book into, a comma separated "
+            "list of formats, or 'all'"
+        )
+    )
+    impose_book.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=1,
+        metavar="N",
+        help="Number of books to impose in parallel, each in its own process"
     )
 
     args = parser.parse_args(args=None if sys.argv[1:] else ["-h"])
@@ -367,7 +448,10 @@ def main():
             'config',
             settings['directories']['schema'],
             'chart-info.json'
-        )
+        ),
+        full_audit=args.full_audit,
+        jobs=args.audit_jobs,
+        pool=args.audit_pool
         )
     if v is False:
         print(f'{x} / {t} charts info.json failed validation.')
@@ -382,6 +466,19 @@ def main():
         if args.charts_cmd == "audit":
             exit()
 
+    if args.cmd == "index":
+        if args.index_cmd in ("rebuild", "update"):
+            added, updated, removed = update_index(
+                library_path,
+                lib,
+                rebuild=(args.index_cmd == "rebuild")
+                )
+            print(
+                f'Library index updated: {added} parts added, '
+                f'{updated} updated, {removed} removed'
+                )
+        exit()
+
     default_instruments = load_instruments(
         os.path.join(
             magicbook_path,
@@ -456,12 +553,39 @@ def main():
             exit()
 
         if args.books_cmd == "build":
+            # charts indexed to count their pages, which assemble_books
+            # then doesn't need to index again
+            indexed_charts = []
+
+            def count_pages(charts):
+                update_index(library_path, charts, prune=False)
+                indexed_charts.extend(charts)
+                index = open_index(library_path, read_only=True)
+                page_counts = chart_page_counts(index)
+                index.close()
+                return page_counts
+
             selected_charts, book_order_data = (
                 assemble_book_questions(
                     ensemble_info,
-                    lib
+                    lib,
+                    count_pages
                     )
                 )
+            if args.plan is not None:
+                plan = build_plan(
+                    selected_charts,
+                    library_path,
+                    ensemble_instruments,
+                    SPLITSORT
+                    )
+                if args.plan == "-":
+                    sys.stdout.write(json.dumps(plan, indent=2) + "\n")
+                else:
+                    with open(args.plan, 'w') as f:
+                        json.dump(plan, f, indent=2)
+                    print(f'Assembly plan saved to {args.plan}')
+                exit()
             issue_dir = assemble_books(
                 selected_charts,
                 library_path,
@@ -470,13 +594,20 @@ def main():
                 ensemble_info['slug'],
                 ensemble_info['name'],
                 book_order_data,
-                SPLITSORT
+                SPLITSORT,
+                staging=settings.get('staging', DEFAULT_CONFIG['staging']),
+                jobs=args.jobs,
+                index_current=len(indexed_charts) > 0
                     )
 
             print(f'Books assembled to {magicbook_path}/{issue_dir}')
             exit()
 
         if args.books_cmd == "impose":
+            from .imposition_tools import (
+                merge_marchpacks,
+                resolve_print_formats
+                )
             if args.book is None:
                 ensemble_slug = impose_choose_ensemble(output_dir)
                 book_dir = impose_choose_book(
@@ -489,7 +620,11 @@ def main():
             if args.print_format is None:
                 book_format = choose_format_questions()
             else:
-                book_format = args.print_format
+                try:
+                    book_format = resolve_print_formats(args.print_format)
+                except ValueError as e:
+                    print(e)
+                    exit(1)
 
             path_to_book = os.path.join(
                 output_dir,
@@ -507,12 +642,32 @@ def main():
             with open(book_info_f) as book_info:
                 book_info = json.load(book_info)
 
-            merge_marchpacks(
+            failed = merge_marchpacks(
                 book_info['charts'],
                 path_to_book,
-                book_format
+                book_format,
+                template_path=os.path.join(
+                    magicbook_path,
+                    'config',
+                    settings['directories']['templates'],
+                    TRIM_GUIDES_FILENAME
+                    ),
+                jobs=args.jobs,
+                toc_layout=settings.get(
+                    'toc-layout',
+                    DEFAULT_CONFIG['toc-layout']
+                    ),
+                toc_renderer=settings.get(
+                    'toc-renderer',
+                    DEFAULT_CONFIG['toc-renderer']
+                    )
             )
 
+            if len(failed) > 0:
+                print(f'{len(failed)} book(s) failed to impose:')
+                for name, error in failed.items():
+                    print(f' - {name}: {error}')
+                exit(1)
             exit()
 
 
@@ -2,8 +2,23 @@ import os
 import shutil
 import datetime
 import json
+import sqlite3
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 
-from .library_tools import strip_part_filename
+from .library_tools import ChartParts, PartFile
+from .index_tools import open_index, update_index, indexed_parts
+from .constants import STAGING_STRATEGIES
+
+try:
+    import fcntl
+except ImportError:
+    # reflinks are only attempted on platforms that support them
+    fcntl = None
+
+# ioctl request to clone a file's extents (linux/fs.h)
+FICLONE = 0x40049409
 
 # should instruments even bee a class? not sure what benefit is gained over
 # reading from a dictionary.
@@ -15,6 +30,90 @@ from .library_tools import strip_part_filename
 #         self.divs = divs
 
 
+def reflink_file(source: str, dest: str):
+    """
+    Creates dest as a copy-on-write clone of source.
+    Raises OSError if the filesystem doesn't support reflinks.
+    """
+    if fcntl is None:
+        raise OSError('reflinks are not supported on this platform')
+    with open(source, 'rb') as src:
+        with open(dest, 'wb') as dst:
+            try:
+                fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+            except OSError:
+                dst.close()
+                os.remove(dest)
+                raise
+
+
+def copy_file(source: str, dest: str):
+    """
+    Copies source to dest byte for byte
+    """
+    with open(source, 'rb') as src:
+        with open(dest, 'wb') as dst:
+            shutil.copyfileobj(src, dst)
+
+
+class PartStager:
+    """
+    Places part files from the library into book folders.
+
+    Staging strategies are tried in the order reflink, hardlink, symlink,
+    copy, starting from the selected mode ('auto' starts with reflink), so
+    a part is only copied byte for byte if no cheaper strategy works.
+    Keeps count of the strategy used for each part.
+    """
+    def __init__(self, mode: str = 'auto'):
+        if mode == 'auto':
+            mode = STAGING_STRATEGIES[0]
+        if mode not in STAGING_STRATEGIES:
+            raise ValueError(
+                f"unknown staging mode {mode}, "
+                f"use one of auto, {', '.join(STAGING_STRATEGIES)}"
+                )
+        self.strategies = STAGING_STRATEGIES[
+            STAGING_STRATEGIES.index(mode):
+            ]
+        self.used = Counter()
+        self._lock = threading.Lock()
+
+    def stage(self, source: str, dest: str) -> str:
+        """
+        Places source at dest, returns the strategy used
+        """
+        for strategy in self.strategies:
+            try:
+                if strategy == 'reflink':
+                    reflink_file(source, dest)
+                elif strategy == 'hardlink':
+                    os.link(source, dest)
+                elif strategy == 'symlink':
+                    os.symlink(os.path.realpath(source), dest)
+                else:
+                    copy_file(source, dest)
+            except OSError:
+                if strategy == self.strategies[-1]:
+                    raise
+                continue
+            with self._lock:
+                self.used[strategy] += 1
+            return strategy
+
+    def report(self) -> str:
+        """
+        Describes how many parts were staged with each strategy
+        """
+        if not self.used:
+            return 'no parts staged'
+        return ', '.join(
+            f'{self.used[strategy]} by {strategy}'
+            for strategy in STAGING_STRATEGIES
+            if self.used[strategy] > 0
+            )
+
+
 def list_books(
         output_dir: str,
         ):
@@ -76,224 +175,311 @@ def prepare_folder(
 def list_parts(
         chart,
         lib_dir: str,
-        ) -> list[tuple]:
+        lib_index: sqlite3.Connection = None
+        ) -> ChartParts:
+    """
+    Given a Chart, and the directory it is located in, returns the chart's
+    parts, keyed by instrument, part number and format.
+    If the library index is provided, the parts are read from the index
+    instead of the chart's directory.
+    """
+    if lib_index is not None:
+        files = [
+            row['filename'] for row in indexed_parts(lib_index, chart.slug)
+        ]
+    elif os.path.isdir(os.path.join(lib_dir, chart.slug)):
+        files = sorted(os.listdir(os.path.join(lib_dir, chart.slug)))
+    else:
+        files = []
+    return ChartParts(chart.slug, files)
+
+
+def route_split_parts(
+        parts: list[PartFile],
+        n: int,
+        books: list[dict]
+        ) -> list[tuple[PartFile, list[str]]]:
     """
-    Given a Chart, and the directory it is located in, returns a list of tuples
-    containing the chart slug, the part slug, and the filename of the part.
+    Given the parts found for a split instrument on one chart, and the number
+    of UNIQUE parts found, returns each part along with the names of the books
+    it belongs in, as laid out in SPLITSORT:
+     - if only one part was found, it goes in every book
+     - otherwise each book takes the part number SPLITSORT assigns it for
+       that number of parts
     """
-    output_list = []
-    for root, dirs, files in os.walk(os.path.join(lib_dir, chart.slug)):
-        for file in files:
-            if file.endswith(".pdf"):
-                part_slug = file.replace(chart.slug, "")
-                output_list.append((chart.slug, part_slug, file))
-    return output_list
-
-
-def parts_grabber(
-        parts: list,
-        ins_slug: str,
-        out_slug: str,
-        input: str,
-        output: str,
-        ) -> int:
+    routes = []
+    for part in parts:
+        if n == 1:
+            dest_books = [book['name'] for book in books]
+        else:
+            dest_books = []
+            for book in books:
+                bookparts = book['parts']
+                z = bookparts[min(n, len(bookparts) + 1) - 2]
+                if z == part.part_number:
+                    dest_books.append(book['name'])
+        if dest_books:
+            routes.append((part, dest_books))
+    return routes
+
+
+def chart_listings(
+        charts: list,
+        lib_dir: str,
+        lib_index: sqlite3.Connection = None
+        ) -> dict[str, ChartParts]:
     """
-    Given an instrument and a list of parts, copies parts for that instrument
-    to a specified output directory, and returns the number of UNIQUE parts
-    found. Calls the strip_part_filename function to remove formatting data
-    from the part name (i.e. "PORTRAIT", "LANDSCAPE"), so it can see whether a
-    part is unique, or is a different format of an already found part.
+    Lists the parts of every chart once, keyed by chart slug,
+    so they can be shared by every instrument
     """
-    n = 0
-    p_slugs_found = []
-    for c_slug, p_slug, fil in parts:
-        if f" {ins_slug}" in p_slug:
-            # space character filters out an instrument[slug] that is
-            # potentially a substring of another instrument[slug]
-            with open(os.path.join(input, c_slug, fil), 'rb') as source:
-                with open(os.path.join(
-                        output,
-                        out_slug,
-                        (c_slug + p_slug)
-                        ), 'wb') as dest:
-                    shutil.copyfileobj(source, dest)
-                    p_slug_short = strip_part_filename(p_slug, c_slug)
-                    print(f" - added {c_slug} {p_slug_short}")
-
-            # this should stop portrait and landscape parts from
-            # being counted as separate parts
-            if p_slug_short not in p_slugs_found:
-                n += 1
-            p_slugs_found.append(p_slug_short)
-    return n
-
-
-def grab_instrument_parts(
+    return {
+        chart.slug: list_parts(chart, lib_dir, lib_index) for chart in charts
+    }
+
+
+def resolve_part_source(
+        parts: ChartParts,
+        chain: tuple[str, ...],
+        resolved: dict = None
+        ) -> tuple[str | None, int, list[PartFile]]:
+    """
+    Given a chart's parts and a chain of instrument slugs, returns the first
+    instrument in the chain with parts for the chart, the number of UNIQUE
+    parts found for it, and its part files. If no instrument in the chain
+    has parts, returns (None, 0, []).
+
+    Results are memoized in `resolved`, keyed by (chart, chain), so
+    a chain of alternates shared by several instruments is only resolved
+    once per chart.
+    """
+    key = (parts.chart_slug, chain)
+    if resolved is not None and key in resolved:
+        return resolved[key]
+    result = (None, 0, [])
+    for ins_slug in chain:
+        n = len(parts.part_numbers(ins_slug))
+        if n > 0:
+            result = (ins_slug, n, parts.instrument_parts(ins_slug))
+            break
+    if resolved is not None:
+        resolved[key] = result
+    return result
+
+
+def plan_instrument(
         instrument: dict,
         charts: list,
-        input: str,
-        output: str,
+        listings: dict[str, ChartParts],
+        SPLITSORT: dict,
+        resolved: dict = None
         ) -> dict:
     """
     For a given instrument, iterates through a list of charts:
      - for each chart, searches for relevant parts for the instrument
      - if part(s) written specifically for the instrument are found,
-       it copies those parts to the instrument's directory in the
-       specified output directory.
+       plans for those parts to be staged in the instrument's folder
+       (or directly in the folders of the instrument's books, if it is
+       split into several books, as laid out in SPLITSORT).
      - if no parts written specifically for the instrument are found,
-       iterates through the instrument's list of alternate instruments.
-       - if it finds parts for the alternate, it copies them to the folder
-         and stops iterating through the list.
-       - if it doesn't find parts for the alternate, moves on to the next
-         alternate in the list
-     - counts the number of parts found for the instrument (0 if no parts
-       were found for the instrument or any of its alternates)
-
-    Args:
-        instrument (dict): a list of instrument dictionaires containing info
-        about the instrument
-        charts (list): a list of Chart objects (see object for details)
-        input (str): the directory where the library is stored
-        output (str): the directory where the parts will be copied
+       iterates through the instrument's list of alternate instruments,
+       and uses the parts of the first alternate that has any.
+     - counts the number of UNIQUE parts found for the instrument (0 if no
+       parts were found for the instrument or any of its alternates).
+       Different formats of the same part (i.e. "PORTRAIT", "LYRE") are
+       all planned, but only counted once.
+     - records which instrument's parts filled the slot (the instrument
+       itself, one of its alternates, or None if the parts are missing)
+
+    Alternates are resolved through `resolved` (see resolve_part_source),
+    which can be shared between instruments.
 
     Returns:
-        inst_charts_info: a dictionary with chart slugs as keys and the number
-        of parts found for that chart as values.
+        the instrument's plan, a dictionary that can be serialized to JSON
     """
-    inst_charts_info = {}
+    if instrument['div'] == 1:
+        books = None
+    else:
+        books = SPLITSORT[instrument['div']]
+
+    alternates = tuple(instrument.get('alternates', ()))
+    chart_plans = []
     for chart in charts:
-        n = parts_grabber(
-            list_parts(chart, input),
-            instrument['slug'],
-            instrument['slug'],
-            input,
-            output
+        parts = listings[chart.slug]
+        source, n, found = resolve_part_source(
+            parts,
+            (instrument['slug'],),
+            resolved
             )
+        if source is None:
+            source, n, found = resolve_part_source(
+                parts,
+                alternates,
+                resolved
+                )
 
-        if n < 1:
-            alternates = instrument['alternates']
-            r = 0
-            for alternate in alternates:
-                r = parts_grabber(
-                    list_parts(chart, input),
-                    alternate,
-                    instrument['slug'],
-                    input,
-                    output
-                    )
-                if r > 0:
-                    inst_charts_info[chart.slug] = r
-                    break
-            if r == 0:
-                print(f"!!! MISSING {chart.title}")
-                inst_charts_info[chart.slug] = 0
+        files = []
+        if source is not None:
+            if books is None:
+                routes = [(part, None) for part in found]
+            else:
+                routes = route_split_parts(found, n, books)
+            for part, dest_books in routes:
+                files.append({
+                    "file": part.filename,
+                    "part": part.part_slug,
+                    "format": part.format,
+                    "books": dest_books
+                })
+        chart_plans.append({
+            "slug": chart.slug,
+            "title": chart.title,
+            "source": source,
+            "parts": n,
+            "files": files
+        })
+
+    return {
+        "slug": instrument['slug'],
+        "name": instrument['name'],
+        "div": instrument['div'],
+        "books": None if books is None else [book['name'] for book in books],
+        "charts": chart_plans
+    }
 
-        else:
-            inst_charts_info[chart.slug] = n
 
-    print('\n')
-    return inst_charts_info
+def plan_books(
+        charts: list,
+        instruments: list[dict],
+        listings: dict[str, ChartParts],
+        SPLITSORT: dict
+        ) -> dict:
+    """
+    Resolves which part files go in which book folders, for every instrument
+    and every selected chart, without touching the filesystem. Alternate
+    instruments, SPLITSORT divisions and part formats are all settled here,
+    so the plan can be inspected, exported as JSON, or carried out
+    by execute_plan.
 
+    Args:
+        charts (list): a list of Chart objects (see object for details)
+        instruments (list): a list of instrument dictionaries
+        listings (dict): the parts of each chart, keyed by chart slug
+        (see chart_listings)
+        SPLITSORT (dict): how the parts of split instruments are sorted
+        into books
 
-def grab_parts(
-        instruments: list[dict],
-        charts: list,
-        issue_dir: str,
+    Returns:
+        plan (dict): the charts and the plan for every instrument
+    """
+    # alternate chains are resolved once per chart, and shared by every
+    # instrument falling back on the same alternates
+    resolved = {}
+    return {
+        "charts": [chart.slug for chart in charts],
+        "instruments": [
+            plan_instrument(
+                instrument,
+                charts,
+                listings,
+                SPLITSORT,
+                resolved
+                )
+            for instrument in instruments
+        ]
+    }
+
+
+def instrument_plan_log(plan: dict) -> list[str]:
+    """
+    Returns the progress messages describing an instrument's plan
+    """
+    lines = [
+        f"Generating {plan['name']} folder(s)!",
+        "==================="
+    ]
+    for chart in plan['charts']:
+        if chart['source'] is None:
+            lines.append(f"!!! MISSING {chart['title']}")
+            continue
+        if chart['source'] != plan['slug']:
+            lines.append(
+                f" - {chart['slug']}: no {plan['slug']} part, "
+                f"using {chart['source']}"
+                )
+        for file in chart['files']:
+            if file['books'] is None:
+                lines.append(f" - added {chart['slug']} {file['part']}")
+            else:
+                lines.append(
+                    f" - added {chart['slug']} {file['part']} "
+                    f"to {', '.join(file['books'])}"
+                    )
+    lines.append('\n')
+    lines.append('\n')
+    return lines
+
+
+def execute_plan(
+        plan: dict,
         lib_dir: str,
-        SPLITSORT: dict,
+        issue_dir: str,
+        stager: PartStager = None,
+        jobs: int = 1
         ):
     """
-    Iterates a list of instruments. For each instrument:
-     - calls a function to grab the relevant part(s) from the library
-       for each selected chart
-     - looks at instrument 'div' value to determine if one or multiple
-       books should be created for each instrument.
-     - If multiple books should be created for each instrument:
-       - reads SPLITSORT (a dictonary of lists of dictionaries) to determine
-         how to split parts when the number of available parts does not equal
-         the number of books for the instrument.
-       - copies the relevant parts into the appropriate book folders.
-       - removes parts from the base instrument folder.
-     - creates a "MISSING_PARTS.txt" file in the base instrument folder
-       - if no relevant parts (either written for that instrument or an
-         alternate part for another instrument) are found, writes the chart
-         title to the text file.
+    Carries out a plan from plan_books:
+     - creates every instrument and book folder up front
+     - stages every planned part in bulk, up to `jobs` files at once
+     - creates a "MISSING_PARTS.txt" file in the base instrument folder,
+       listing the charts for which no relevant parts (either written for
+       that instrument or an alternate part for another instrument) were
+       found
+
+    Progress is printed in the order of the plan, no matter how many jobs
+    are used.
 
     NOTE
-     - this function is a bit of a mess and could use some refactoring.
-       - (thank you copilot for suggesting this =P)
      - this function does NOT return any values in Python as of this writing.
        It copies PDFs to a directory specified in the input. The internal
        directory structure is assumed. Any function that operates on the output
        of this function needs to be aware of the internal directory structure.
     """
-    for instrument in instruments:
+    if stager is None:
+        stager = PartStager()
+
+    staging = []
+    for instrument in plan['instruments']:
         inspath = os.path.join(issue_dir, instrument['slug'])
         os.makedirs(inspath)
+        for book in instrument['books'] or []:
+            os.makedirs(os.path.join(inspath, book))
+        for chart in instrument['charts']:
+            for file in chart['files']:
+                source = os.path.join(lib_dir, chart['slug'], file['file'])
+                if file['books'] is None:
+                    staging.append(
+                        (source, os.path.join(inspath, file['file']))
+                        )
+                    continue
+                for book in file['books']:
+                    staging.append(
+                        (source, os.path.join(inspath, book, file['file']))
+                        )
 
-        print(f"Generating {instrument['name']} folder(s)!")
-        print("===================")
-
-        if instrument['div'] == 1:
-            divdict = grab_instrument_parts(
-                instrument,
-                charts,
-                lib_dir,
-                issue_dir
-                )
-        else:
-            divdict = grab_instrument_parts(
-                instrument,
-                charts,
-                lib_dir,
-                issue_dir
-                )
-
-            for book in SPLITSORT[instrument['div']]:
-                bpath = os.path.join(issue_dir,
-                                     instrument["slug"],
-                                     book["name"]
-                                     )
-                if not os.path.exists(bpath):
-                    os.makedirs(bpath)
-                print(f"{instrument["name"]} {book["name"]}:")
-                for chart in divdict:
-                    chart_part_divs = divdict[chart]
-                    if chart_part_divs == 1:
-                        for file in os.listdir(inspath):
-                            if chart in file:
-                                dpath = os.path.join(bpath, file)
-                                source = open(os.path.join(inspath,
-                                                           file
-                                                           ), 'rb')
-                                dest = open(dpath, 'wb')
-                                shutil.copyfileobj(source, dest)
-                                print(f" * added {file}")
-
-                                source.close()
-                                dest.close()
-                    elif chart_part_divs > 1:
-                        bookparts = book["parts"]
-
-                        z = bookparts[(chart_part_divs - 2)]
-                        for file in os.listdir(inspath):
-                            if chart in file:
-                                if f"{instrument['slug']}{z}" in file:
-                                    dpath = os.path.join(bpath, file)
-                                    source = open(os.path.join(inspath,
-                                                               file
-                                                               ), 'rb')
-                                    dest = open(dpath, 'wb')
-                                    shutil.copyfileobj(source, dest)
-                                    print(f" * added {file}")
-                                    source.close()
-                                    dest.close()
-            for item in os.listdir(inspath):
-                itempath = os.path.join(inspath, item)
-                if os.path.isfile(itempath):
-                    os.remove(itempath)
-            print("\n")
-        print("\n")
+    if jobs > 1:
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            list(executor.map(lambda op: stager.stage(*op), staging))
+    else:
+        for source, dest in staging:
+            stager.stage(source, dest)
+
+    alternates = 0
+    for instrument in plan['instruments']:
+        print('\n'.join(instrument_plan_log(instrument)))
+        alternates += sum(
+            1 for chart in instrument['charts']
+            if chart['source'] not in (None, instrument['slug'])
+            )
         with open(
             os.path.join(
                 issue_dir,
@@ -303,10 +489,34 @@ def grab_parts(
                 ) as f:
             f.write(f"Missing parts for {instrument['name']}:\n")
             f.write("========================\n")
-            for chart in divdict:
-                if divdict[chart] == 0:
-                    f.write(str(chart))
+            for chart in instrument['charts']:
+                if chart['source'] is None:
+                    f.write(chart['slug'])
                     f.write("\n")
+    if alternates > 0:
+        print(f'{alternates} chart slot(s) filled with alternate parts')
+
+
+def build_plan(
+        selected_charts: list,
+        lib_dir: str,
+        instruments: list,
+        SPLITSORT: dict
+        ) -> dict:
+    """
+    Plans a book build without changing anything on disk. Parts are listed
+    from the chart directories, as the library index may not be up to date
+    until the books are built.
+    """
+    loc = []
+    for d in selected_charts:
+        for c in d.values():
+            loc.append(c)
+
+    listings = chart_listings(loc, lib_dir)
+    plan = plan_books(loc, instruments, listings, SPLITSORT)
+    plan['library'] = os.path.abspath(lib_dir)
+    return plan
 
 
 def assemble_books(
@@ -318,11 +528,21 @@ def assemble_books(
         ensemble_name: str,
         book_order_data: tuple[bool, int, bool],
         SPLITSORT: dict,
+        staging: str = 'auto',
+        jobs: int = 1,
+        index_current: bool = False
         ) -> str:
     """
     Create books to hand out to ensemble members
     with charts for their instrument
 
+    Parts are staged in the book folders with the `staging` mode from the
+    library config: 'auto', 'reflink', 'hardlink', 'symlink' or 'copy'.
+    The build is planned first (see plan_books), then the planned parts are
+    staged in bulk, up to `jobs` files at once. The library index is
+    updated for the selected charts first, unless `index_current` says it
+    already was.
+
     Returns:
         issue_dir (str): the directory where the sorted charts are saved, based
         on the ensemble name and the date and time the books were generated
@@ -331,6 +551,8 @@ def assemble_books(
     max_id = book_order_data[1]
     custom_order = book_order_data[2]
 
+    # an unknown staging mode is raised before any folders are made
+    stager = PartStager(staging)
     issue_dir, raw, imposed = prepare_folder(output_dir, ensemble_dir)
 
     raw_dir = os.path.join(issue_dir, raw)
@@ -340,14 +562,19 @@ def assemble_books(
         for c in d.values():
             loc.append(c)
 
+    # brings the library index up to date for the selected charts, so parts
+    # are looked up in the index rather than by walking the library, unless
+    # index_current says they were just indexed
+    if index_current is False:
+        update_index(lib_dir, loc, prune=False)
+    lib_index = open_index(lib_dir)
+
     # parts_in_book = list_parts(selected_charts, lib_dir)
-    grab_parts(
-        instruments,
-        loc,
-        raw_dir,
-        lib_dir,
-        SPLITSORT
-        )
+    listings = chart_listings(loc, lib_dir, lib_index)
+    lib_index.close()
+    plan = plan_books(loc, instruments, listings, SPLITSORT)
+    execute_plan(plan, lib_dir, raw_dir, stager, jobs)
+    print(f'Parts staged: {stager.report()}')
 
     if abside is True:
         a_list = []
@@ -413,9 +640,11 @@ def assemble_books(
             "imposed": imposed
         },
         "ensemble": ensemble_name,
+        "library": os.path.abspath(lib_dir),
         "abside": abside,
         "max_id": max_id,
         "custom_order": custom_order,
+        "staging": dict(stager.used),
         "instruments": instruments,
         "charts": chart_list
     }
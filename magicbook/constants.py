@@ -15,6 +15,9 @@ DEFAULT_CONFIG = {
   },
   "default-ensemble": "generic_ensemble.json",
   "default-instruments": "instruments.json",
+  "staging": "auto",
+  "toc-layout": "standard",
+  "toc-renderer": "platypus",
   "paper-sizes": {
     "Marchpack": {
       "width": 504,
@@ -404,9 +407,27 @@ LETTER_MARGIN_Y = 10
 
 PAGE_FORMATS = ['PORTRAIT', 'LYRE']
 
+# Ways of placing library parts in book folders, cheapest first
+
+STAGING_STRATEGIES = ('reflink', 'hardlink', 'symlink', 'copy')
+
+# Library cache files
+
+AUDIT_CACHE_FILENAME = '.audit-cache.json'
+INDEX_FILENAME = '.library-index.sqlite'
+TRIM_GUIDES_FILENAME = 'trim-guides.pdf'
+
 MARCHPACK_FORMATS = ('MarchpackSplit', 'MarchpackComprehensive')
 BINDER_FORMATS = ('BinderOnePartPg',
                   'BinderOneChartPg',
                   'BinderSaveSomePaper',
                   'BinderSaveLotsPaper'
                   )
+
+# table of contents layouts, `compact` fits more charts on each page
+TOC_LAYOUTS = ('standard', 'compact')
+# ways of drawing a table of contents, `canvas` is the quickest
+TOC_RENDERERS = ('platypus', 'canvas')
+
+# the formats merge_marchpacks can impose, used by `--print-format all`
+IMPOSABLE_FORMATS = ('MarchpackComprehensive', 'BinderOnePartPg')
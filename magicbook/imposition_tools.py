@@ -8,10 +8,19 @@ import pypdf
 # import library_tools
 import json
 from io import BytesIO
+from functools import lru_cache, partial
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Callable, Iterator, NamedTuple
 from reportlab.pdfgen import canvas
 from reportlab.lib.pagesizes import letter
 
-from .library_tools import Chart, strip_part_filename, create_chart_object
+from .library_tools import (
+    Chart,
+    ChartParts,
+    create_chart_object,
+    group_part_files
+)
+from .index_tools import PageCache, PageGeometry
 from .toc_tools import compile_toc_data, create_toc
 from .constants import (SPLITSORT,
                         LYRE_PAPER_X,
@@ -21,19 +30,32 @@ from .constants import (SPLITSORT,
                         #    LETTER_MARGIN_X,
                         #    LETTER_MARGIN_Y,
                         MARCHPACK_FORMATS,
-                        BINDER_FORMATS
+                        BINDER_FORMATS,
+                        IMPOSABLE_FORMATS,
+                        TRIM_GUIDES_FILENAME,
+                        DEFAULT_CONFIG
                         )
 
+# where the trim guides template is found when no library root is given,
+# relative to the current working directory
+TRIM_GUIDES_PATH = os.path.join('config', 'templates', TRIM_GUIDES_FILENAME)
 
-def count_pdf_pages(pdf_path: str) -> int:
+
+def count_pdf_pages(
+        pdf_path: str,
+        page_cache: PageCache = None
+        ) -> int:
     """
     Returns the number of pages in a pdf
+    If a page cache is provided, the page count is looked up by the
+    file's content hash, and the pdf is only opened if it isn't cached.
     """
+    if page_cache is not None:
+        return page_cache.page_count(pdf_path)
     with open(pdf_path, 'rb') as pdf:
         pdf_reader = pypdf.PdfReader(pdf)
         num_pages = pdf_reader.get_num_pages()
         pdf_reader.close()
-        print(num_pages)
         return num_pages
 
 
@@ -45,14 +67,18 @@ class Part(Chart):
             page_id,
             part_path,
             format,
-            prefix=None
+            prefix=None,
+            page_cache=None
             ):
         super().__init__(chart.slug, chart.is_single, chart.sl, chart.title)
         self.part_title = part_title
         self.page_id = page_id
         self.part_path = part_path
         self.format = format
-        self.pagect = count_pdf_pages(part_path)
+        if page_cache is None:
+            page_cache = PageCache()
+        self.geometry = page_cache.geometry(part_path)
+        self.pagect = len(self.geometry)
         self.prefix = prefix
 
 
@@ -87,28 +113,77 @@ def impose_and_merge_portrait(
     pass
 
 
-def merge_parts(parts: list):
+class PartPage(NamedTuple):
     """
-    given a list of Parts, merges all parts into a single PDF
-    and returns the merged PDF and a list of chart IDs
+    A single page of a part, with the chart ID it is stamped with,
+    its cached geometry, and a function that loads the page itself
     """
+    chart_id: str
+    geometry: PageGeometry
+    load: Callable[[], pypdf.PageObject]
 
-    print("merging parts using new function....")
-
-    merged_parts = BytesIO()
 
-    list_of_stamps = []
-    counter = 0
-    merger = pypdf.PdfWriter()
+def stream_part_pages(parts: list) -> Iterator[PartPage]:
+    """
+    given a list of Parts, yields the pages of every part in order, each
+    with the chart ID of its part. A part's pdf is only opened once one of
+    its pages is loaded, only one part's pdf is open at a time, and each
+    page should be used before the next one is requested.
+    """
     for part in parts:
-        merger.append(part.part_path)
-        for n in range(0, (merger.get_num_pages() - counter)):
-            list_of_stamps.append(part.page_id)
-        counter = merger.get_num_pages()
-    merger.write(merged_parts)
-    merger.close()
-
-    return merged_parts, list_of_stamps
+        source = {}
+
+        def load(n: int, part=part, source=source) -> pypdf.PageObject:
+            if 'reader' not in source:
+                source['pdf'] = open(part.part_path, 'rb')
+                source['reader'] = pypdf.PdfReader(source['pdf'])
+            return source['reader'].get_page(n)
+
+        try:
+            for n, geometry in enumerate(part.geometry):
+                yield PartPage(part.page_id, geometry, partial(load, n))
+        finally:
+            if 'reader' in source:
+                source['reader'].close()
+                source['pdf'].close()
+
+
+def fit_to_paper(
+        geometry: PageGeometry,
+        paper_x: float,
+        content_x: float,
+        content_y: float
+        ) -> tuple[pypdf.Transformation, float]:
+    """
+    Returns the transformation that moves a page's cropped content to 0,0,
+    scales it to fit the content area while maintaining aspect ratio, and
+    moves it as close to centered on the page x axis as possible without
+    overlapping the right margin area. Also returns the cropped height of
+    the page.
+    """
+    # if the page was cropped, this makes sure we operate on the
+    # cropped dimensions, read from the page cache rather than the page
+    cropbox = pypdf.generic.RectangleObject(geometry.cropbox)
+    h = float(cropbox.height)
+    w = float(cropbox.width)
+
+    scale_factor = min(content_x / w, content_y / h)
+
+    trans_x = ((paper_x - (w * scale_factor)) / 2)
+    if trans_x + (w * scale_factor) > content_x:
+        trans_x = ((content_x - (w * scale_factor)) / 2)
+
+    transform = pypdf.Transformation().translate(
+        tx=(cropbox.left * -1),
+        ty=(cropbox.bottom * -1)
+        ).scale(
+        scale_factor,
+        scale_factor
+        ).translate(
+        tx=trans_x,
+        ty=((content_y - (h * scale_factor)) / 2)
+        )
+    return transform, h
 
 
 def create_stamp(
@@ -151,185 +226,298 @@ def create_stamp(
     return stamp_packet
 
 
-def impose_and_merge(
-        parts: list,
-        blanks: int,
-        output_name: str,
-        format: str,
-        toc: BytesIO = None,
-        prefix=None
-        ) -> BytesIO:
+@lru_cache(maxsize=256)
+def stamp_page(
+        stamp,
+        stamp_location: str,
+        paper_size: tuple,
+        stamp_font: str,
+        stamp_size: int,
+        prefix: str
+        ) -> pypdf.PageObject:
+    """
+    Renders a stamp with create_stamp and returns it as a parsed page.
+    Each unique stamp is only rendered once, and the page is reused
+    for every page of every chart that gets the same stamp.
     """
-    merges the pdfs from a list of parts, and adds n blank pages to the end
-    calls create_stamp to add a chart ID to each page as well
-    then subsequently scales all pages to fit on selected paper
+    return pypdf.PdfReader(
+        create_stamp(
+            stamp,
+            stamp_location,
+            paper_size,
+            stamp_font,
+            stamp_size,
+            prefix
+            )
+        ).get_page(0)
+
+
+class BookPaper(NamedTuple):
     """
+    The paper a book format is printed on, the area the music is fitted
+    into, and where and how large the chart ID stamp is
+    """
+    paper_x: float
+    paper_y: float
+    content_x: float
+    content_y: float
+    stamp_location: str
+    stamp_size: int
+
 
+def book_paper(format: str) -> BookPaper:
+    """
+    Returns the paper geometry of a book format
+    """
     if format in MARCHPACK_FORMATS:
-        paper_x = LYRE_PAPER_X
-        paper_y = LYRE_PAPER_Y
-        content_x = LYRE_CONTENT_X
-        content_y = LYRE_CONTENT_Y
-        stamp_location = 'bottom_right'
-        stamp_size = 30
+        return BookPaper(
+            LYRE_PAPER_X,
+            LYRE_PAPER_Y,
+            LYRE_CONTENT_X,
+            LYRE_CONTENT_Y,
+            'bottom_right',
+            30
+            )
     elif format in BINDER_FORMATS:
-        paper_x = letter[0]
-        paper_y = letter[1]
-        content_x = paper_x
-        content_y = paper_y
         # content_x = (paper_x - (LETTER_MARGIN_X * 2))
         # content_y = (paper_y - (LETTER_MARGIN_Y * 2))
-        stamp_location = 'top_right'
-        stamp_size = 40
-
-    new_bytes_object = BytesIO()
-
-    new_bytes_object, list_of_stamps = merge_parts(parts)
+        return BookPaper(
+            letter[0],
+            letter[1],
+            letter[0],
+            letter[1],
+            'top_right',
+            40
+            )
+    raise ValueError(f'unknown book format {format}')
 
-    # note: at this pointin the code new_bytes_object stores the merged PDFs,
-    # without any scaling or stamping
 
-    reader = pypdf.PdfReader(new_bytes_object)
-    writer = pypdf.PdfWriter()
+def impose_side(
+        parts: list,
+        blanks: int,
+        format: str,
+        toc: BytesIO = None,
+        prefix=None
+        ) -> Iterator[list[tuple[pypdf.PageObject, pypdf.Transformation]]]:
+    """
+    Yields the pages of one side of a book, each as a list of layers from
+    bottom to top. Each layer is a page and the transformation that scales
+    and places it on the book's paper:
+     - every page of the table of contents, if one is provided
+       (it must be pre-scaled)
+     - every page of the parts, with a stamp of its chart ID on top
+     - n blank pages (no layers) at the end, to balance the side with
+       the opposite side of the marchpack
+    Each page's layers should be used before the next page is requested.
+    """
+    paper = book_paper(format)
+    paper_size = (paper.paper_x, paper.paper_y)
+    place = pypdf.Transformation()
 
-    # if a table of contents is provided to the function,
-    # it is the first PDF added
-    # to the merged and imposed PDF
-    # note that for this to work, we need to always
-    # provide a TOC that is pre-scaled!
     if toc is not None:
         toc_reader = pypdf.PdfReader(toc)
-        toc_page = toc_reader.get_page(0)
-        writer.add_page(toc_page)
+        for toc_page in toc_reader.pages:
+            yield [(toc_page, place)]
         toc_reader.close()
 
-    # executes the code on each page in the
-    for n in range(0, reader.get_num_pages()):
-        # opens the PDF stored in the buffer (merged unscaled parts)
-        packet = BytesIO()
-
-        packet = create_stamp(list_of_stamps[n],
-                              stamp_location,
-                              (paper_x, paper_y),
-                              "Helvetica-Bold",
-                              stamp_size,
-                              prefix)
-
-        page = reader.get_page(n)
-
-        # if the page was cropped, this makes sure
-        # we operate on the cropped dimensions
-        page.mediabox = page.cropbox
-
-        # moves the content to start at 0,0
-        xt = (page.mediabox.left * -1)
-        yt = (page.mediabox.bottom * -1)
-        trans = pypdf.Transformation().translate(tx=xt, ty=yt)
-        page.add_transformation(trans)
-
-        # set of operations to move the mediabox and cropbox
-        # to the new location of the content
-        newx = page.mediabox.width
-        newy = page.mediabox.height
-        page.cropbox = pypdf.generic.RectangleObject((0, 0, newx, newy))
-        page.mediabox = page.cropbox
-        h = float(page.mediabox.height)
-        w = float(page.mediabox.width)
-
-        # scales to fit the page while maintaining aspect ratio
-        scale_factor = min(content_x / w, content_y / h)
-        transform = pypdf.Transformation().scale(scale_factor, scale_factor)
-        page.add_transformation(transform)
-
-        page.cropbox = pypdf.generic.RectangleObject([0, 0, paper_x, paper_y])
-
-        print(f"{list_of_stamps[n]}: {h}")
-        # opens the previously created stamp from the packet
-        new_pdf = pypdf.PdfReader(packet)
-        page_new = new_pdf.get_page(0)
-        page.mediabox = page_new.mediabox
-
-        # moves content as close to centered on the page x axis as possible
-        # without overlapping the right margin area.
-        trans_x = ((paper_x - (w * scale_factor)) / 2)
-        if trans_x + (w * scale_factor) > content_x:
-            trans_x = ((content_x - (w * scale_factor)) / 2)
-
-        # merges the page onto the stamp
-        page_new.merge_transformed_page(
-            page,
-            pypdf.Transformation().translate(
-                tx=trans_x,
-                ty=((content_y - (h * scale_factor)) / 2),
-            ),
-            False
+    # executes the code on each page of the parts, taken straight from
+    # each part's pdf, without merging the parts first
+    for part_page in stream_part_pages(parts):
+        # the stamp is rendered once per chart, not once per page
+        stamp = stamp_page(part_page.chart_id,
+                           paper.stamp_location,
+                           paper_size,
+                           "Helvetica-Bold",
+                           paper.stamp_size,
+                           prefix)
+
+        transform, h = fit_to_paper(
+            part_page.geometry,
+            paper.paper_x,
+            paper.content_x,
+            paper.content_y
             )
-        writer.add_page(page_new)
-        packet.close()
-
-    # for loop finshed, now appends blank page
-    # to the end of the PDF to balance it with
-    # the opposite side of the marchpack
-    if blanks > 0:
-        for n in range(0, blanks):
-            writer.add_blank_page(width=paper_x, height=paper_y)
-    bytes_output = BytesIO()
-    writer.write(bytes_output)
+
+        yield [(part_page.load(), transform), (stamp, place)]
+
+    for n in range(0, blanks):
+        yield []
+
+
+def impose_and_merge(
+        sides: list[Iterator],
+        output_path: str,
+        format: str
+        ):
+    """
+    Places the pages of each side of a book (see impose_side) on the book's
+    paper, one side after the other, and writes them to `output_path` as a
+    single pdf. Every page goes into the same writer, so the sides are never
+    written out and merged again.
+    """
+    paper = book_paper(format)
+    if os.path.exists(os.path.dirname(output_path)) is False:
+        os.makedirs(os.path.dirname(output_path))
+
+    writer = pypdf.PdfWriter()
+    for side in sides:
+        for layers in side:
+            page_new = writer.add_blank_page(
+                width=paper.paper_x,
+                height=paper.paper_y
+                )
+            for page, transform in layers:
+                page_new.merge_transformed_page(page, transform)
+
+    writer.write(output_path)
     writer.close()
-    reader.close()
-    new_bytes_object.close()
 
-    return bytes_output
 
+@lru_cache(maxsize=8)
+def load_template(template_path: str) -> pypdf.PageObject:
+    """
+    Loads the first page of a template pdf. Each template is only parsed
+    once per process, and the page is reused for every sheet printed on it.
+    """
+    return pypdf.PdfReader(template_path).get_page(0)
+
+
+# where the A and B sides of a marchpack are placed on a US Letter sheet
+A_SIDE_PLACEMENT = pypdf.Transformation().translate(tx=54, ty=396)
+B_SIDE_PLACEMENT = pypdf.Transformation().rotate(180).translate(tx=558, ty=396)
 
-def impose_for_printing(path_to_a: str,
-                        path_to_b: str,
-                        final_output_path: str):
+
+def impose_for_printing(a_side: Iterator,
+                        b_side: Iterator,
+                        final_output_path: str,
+                        template_path: str = TRIM_GUIDES_PATH):
     """
     Places the marchpacks onto US Letter paper for printing, with the
     A side on the top of each page and the B side on the bottom.
+    Each sheet is printed on the trim guides template at `template_path`.
+
+    The sides are the pages yielded by impose_side. Each layer's scaling
+    and placement on its side is composed with the side's placement on
+    the sheet, so every source page is placed on its final sheet with a
+    single transformation, and the sides are never written out on their
+    own.
     """
     if os.path.exists(os.path.dirname(final_output_path)) is False:
         os.makedirs(os.path.dirname(final_output_path))
-    reader_n = pypdf.PdfReader(path_to_a)
-    # num_of_pages = reader_n.get_num_pages()
 
+    template = load_template(template_path)
     writer = pypdf.PdfWriter()
 
-    reader_a = pypdf.PdfReader(path_to_a)
-    reader_b = pypdf.PdfReader(path_to_b)
-
-    for pg in range(0, reader_n.get_num_pages()):
-        reader_template = pypdf.PdfReader(
-            "config/templates/trim-guides.pdf"
+    for a_layers, b_layers in zip(a_side, b_side, strict=True):
+        # copies the cached template onto a new sheet, so the cached page
+        # itself is never modified
+        page = writer.add_blank_page(
+            width=template.mediabox.width,
+            height=template.mediabox.height
             )
-        page = reader_template.get_page(0)
-        a_page = reader_a.get_page(pg)
-        b_page = reader_b.get_page(pg)
-        page.merge_transformed_page(
-            a_page,
-            pypdf.Transformation().translate(tx=54, ty=396),
-            False)
-        page.merge_transformed_page(
-            b_page,
-            pypdf.Transformation().rotate(180).translate(tx=558, ty=396),
-            False)
-        writer.add_page(page)
-        reader_template.close()
+        for layer, transform in b_layers:
+            page.merge_transformed_page(
+                layer,
+                transform.transform(B_SIDE_PLACEMENT)
+                )
+        for layer, transform in a_layers:
+            page.merge_transformed_page(
+                layer,
+                transform.transform(A_SIDE_PLACEMENT)
+                )
+        page.merge_page(template)
 
     writer.write(final_output_path)
-    reader_a.close()
-    reader_b.close()
-
     writer.close()
-    reader_n.close()
 
 
-def auto_order_charts(charts: list[Chart], abside: bool) -> list[dict]:
+def side_sheets(pages: list[int], a_count: int, toc_pages: int = 1) -> int:
+    """
+    Returns the number of sheets a marchpack book is printed on, when the
+    first `a_count` charts go on the A side (after the table of contents)
+    and the rest go on the B side
+    """
+    return max(toc_pages + sum(pages[:a_count]), sum(pages[a_count:]))
+
+
+def balance_sides(
+        pages: list[int],
+        max_id: int = None,
+        toc_pages: int = 1
+        ) -> tuple[int, int]:
+    """
+    Given the page count of each chart, in book order, finds how many
+    charts should go on the A side, keeping the order, so the A and B
+    sides need the least blank padding. With `max_id`, the B side is
+    numbered up to max_id, so it can't have more than max_id charts.
+    Ties go to the split closest to an even split by chart count.
+
+    Returns:
+        the number of charts for the A side, and the number of sheets
+        saved per book compared to splitting the charts evenly
+    """
+    n = len(pages)
+    even = n // 2
+    best = even
+    best_key = (side_sheets(pages, even, toc_pages), 0)
+    for a_count in range(0, n + 1):
+        if max_id is not None and n - a_count > max_id:
+            continue
+        key = (side_sheets(pages, a_count, toc_pages), abs(a_count - even))
+        if key < best_key:
+            best = a_count
+            best_key = key
+    return best, side_sheets(pages, even, toc_pages) - best_key[0]
+
+
+def split_sides(
+        charts: list[Chart],
+        a_count: int,
+        max_id: int
+        ) -> list[dict]:
+    """
+    Puts the first `a_count` charts on the A side, numbered from 1, and the
+    rest on the B side, numbered up to max_id
+
+    Returns:
+        the A and B chart indices
+    """
+    a_index = {}
+    for a_id, chart in enumerate(charts[:a_count], start=1):
+        a_index[a_id] = chart
+    b_index = {}
+    for b_id, chart in enumerate(
+            charts[a_count:],
+            start=(max_id - (len(charts) - a_count)) + 1
+            ):
+        b_index[b_id] = chart
+    return [a_index, b_index]
+
+
+def auto_order_charts(
+        charts: list[Chart],
+        abside: bool,
+        pages: dict[str, int] = None,
+        max_id: int = None
+        ) -> list[dict]:
     """
     Automatically orders the charts in the order they are received
     returns a list of one or two chart indices
+    If the page count of each chart is provided, charts are split between
+    the A and B sides to balance their page counts (see balance_sides),
+    and the B side is numbered up to max_id.
     """
+    if abside is True and pages is not None:
+        a_count, saved = balance_sides(
+            [pages.get(chart.slug, 1) for chart in charts],
+            max_id
+            )
+        if saved > 0:
+            print(f'Balancing by page count saves {saved} sheet(s) per book')
+        if max_id is None:
+            max_id = len(charts) - a_count
+        return split_sides(charts, a_count, max_id)
+
     charts_rem = charts.copy()
     if abside is True:
         marchpack_pages = (len(charts_rem) // 2)
@@ -356,81 +544,305 @@ def auto_order_charts(charts: list[Chart], abside: bool) -> list[dict]:
         return [x_index]
 
 
-def pdf_path_list(path: str, index: dict, format: str, prefix=None) -> list:
+def page_formats_for(book_format: str) -> tuple[str, str]:
+    """
+    Returns the page format of the parts a book format prefers,
+    and the page format used when a part isn't available in it
+    """
+    if book_format in MARCHPACK_FORMATS:
+        return "LYRE", "PORTRAIT"
+    return "PORTRAIT", "LYRE"
+
+
+def pdf_path_list(
+        path: str,
+        index: dict,
+        format: str,
+        prefix=None,
+        page_cache: PageCache = None,
+        chart_files: dict[str, ChartParts] = None
+        ) -> list:
     """
     given an index, rturns a list of pdf paths
+    page counts are read from the page cache, if one is provided
+    the parts found in the directory can be passed in as chart_files,
+    if they have already been listed (see group_part_files)
     """
-    for f in MARCHPACK_FORMATS:
-        if format is f:
-            preferred_format = "LYRE"
-            other_format = "PORTRAIT"
-        else:
-            preferred_format = "PORTRAIT"
-            other_format = "LYRE"
+    preferred_format, other_format = page_formats_for(format)
 
     if prefix is None:
         pre = ''
     else:
         pre = prefix
 
+    # parses the directory listing once, so each chart's parts
+    # are found by a lookup rather than by searching the filenames
+    if chart_files is None:
+        chart_files = group_part_files(os.listdir(path))
+
     pdf_list = []
     pdf_pages = 0
     for chart_id in index.keys():
-        prefer_find = []
-        other_find = []
-        for file in os.listdir(path):
-            if index[chart_id].slug in file:
-                if preferred_format in file:
-                    print(f"found {index[chart_id].slug}")
-                    print(f"in file {file}")
-                    prefer_find.append(file)
-                else:
-                    other_find.append(file)
-        for part in prefer_find:
-            print(f"part in prefer_find: {part}")
-
-            part_slug = strip_part_filename(
-                str(part),
-                str(index[chart_id].slug)
+        parts = chart_files.get(index[chart_id].slug)
+        if parts is None:
+            continue
+        prefer_find, other_find = parts.select_format(
+            preferred_format,
+            other_format
             )
+        for part in prefer_find:
             part_obj = Part(
                 index[chart_id],
-                part_slug,
+                part.part_slug,
                 f'{chart_id}',
-                os.path.join(path, part),
+                os.path.join(path, part.filename),
                 preferred_format,
-                prefix=str(pre)
+                prefix=str(pre),
+                page_cache=page_cache
             )
             pdf_list.append(part_obj)
             pdf_pages += part_obj.pagect
         for part in other_find:
-            part_slug = strip_part_filename(
-                str(part),
-                str(index[chart_id].slug)
-            )
-            print(f"found non-preferred format {part_slug}")
-            if any(part_slug in s for s in prefer_find) is False:
-                part_obj = Part(
-                    index[chart_id],
-                    part_slug,
-                    f'{chart_id}',
-                    os.path.join(path, part),
-                    other_format,
-                    str(pre)
-                    )
-                pdf_list.append(part_obj)
-                pdf_pages += part_obj.pagect
+            part_obj = Part(
+                index[chart_id],
+                part.part_slug,
+                f'{chart_id}',
+                os.path.join(path, part.filename),
+                other_format,
+                str(pre),
+                page_cache=page_cache
+                )
+            pdf_list.append(part_obj)
+            pdf_pages += part_obj.pagect
     return pdf_list, pdf_pages
 
 
+def resolve_print_formats(spec: str) -> list[str]:
+    """
+    Given a print format, a comma separated list of print formats, or
+    "all", returns the list of book formats to impose
+    """
+    if spec.strip() == 'all':
+        return list(IMPOSABLE_FORMATS)
+    book_formats = []
+    for book_format in spec.split(','):
+        book_format = book_format.strip()
+        if book_format not in MARCHPACK_FORMATS + BINDER_FORMATS:
+            raise ValueError(f'unknown print format {book_format}')
+        if book_format not in book_formats:
+            book_formats.append(book_format)
+    return book_formats
+
+
+def book_tasks(
+        instruments: list[dict],
+        raw_dir: str
+        ) -> list[dict]:
+    """
+    Returns one imposition task for every book in the issue: one for each
+    instrument, or one for each of its SPLITSORT books if it is split.
+    Each task gives the book's name, where its parts are, and the slug
+    its imposed pdfs are named after.
+    """
+    tasks = []
+    for instrument in instruments:
+        if instrument['div'] == 1:
+            tasks.append({
+                "name": instrument['name'],
+                "slug": instrument['slug'],
+                "path": os.path.join(raw_dir, instrument['slug'])
+            })
+        elif instrument['div'] < 1:
+            raise ValueError("""an instrument can't be divided
+                             into less than one part!
+                            check your ensemble json file!""")
+        else:
+            for book in SPLITSORT[instrument['div']]:
+                tasks.append({
+                    "name": f"{instrument['name']} {book['name']}",
+                    "slug": f'{instrument['slug']}{book['name']}',
+                    "path": os.path.join(
+                        raw_dir,
+                        instrument['slug'],
+                        book['name']
+                        )
+                })
+    return tasks
+
+
+def impose_book(
+        task: dict,
+        a_index: dict,
+        b_index: dict,
+        c_list: list,
+        ensemble: str,
+        book_formats: list[str],
+        imposed_dir: str,
+        library: str = None,
+        template_path: str = TRIM_GUIDES_PATH,
+        add_toc: bool = True,
+        toc_layout: str = DEFAULT_CONFIG['toc-layout'],
+        toc_renderer: str = DEFAULT_CONFIG['toc-renderer']
+        ) -> list[str]:
+    """
+    Imposes a single book (see book_tasks) into a final pdf for each of
+    the book formats. The book's parts are found, counted and listed in
+    the table of contents once, and shared by every format that prefers
+    the same page format; only the paper geometry is applied per format.
+    Only the book's own files are written, so several books can be imposed
+    at once, in separate processes.
+    Marchpack pages are placed straight onto their printed sheets, and both
+    sides of a binder book are imposed into one pdf (see impose_and_merge).
+    The table of contents uses the `toc_layout` layout and is drawn by the
+    `toc_renderer` renderer (see create_toc). The opposite side is padded
+    for every page it runs onto.
+
+    Returns:
+        the paths of the imposed pdfs
+    """
+    # page counts and sizes are cached in the library index, by content
+    # hash. books built before the library index was added don't record
+    # which library they came from, so their pages are only cached in memory
+    if os.path.isdir(library or ''):
+        page_cache = PageCache(library)
+    else:
+        page_cache = PageCache()
+
+    # parses the directory listing once for every format
+    chart_files = group_part_files(os.listdir(task['path']))
+
+    selections = {}
+    outputs = []
+    for book_format in book_formats:
+        preferred_format = page_formats_for(book_format)[0]
+        if preferred_format not in selections:
+            a_parts, a_pages = pdf_path_list(
+                task['path'],
+                a_index,
+                book_format,
+                prefix='A',
+                page_cache=page_cache,
+                chart_files=chart_files
+                )
+            b_parts, b_pages = pdf_path_list(
+                task['path'],
+                b_index,
+                book_format,
+                prefix='B',
+                page_cache=page_cache,
+                chart_files=chart_files
+                )
+            toc_data = None
+            if add_toc is True:
+                toc_data = compile_toc_data(c_list, a_parts, b_parts)
+            selections[preferred_format] = (
+                a_parts,
+                a_pages,
+                b_parts,
+                b_pages,
+                toc_data
+                )
+        a_parts, a_pages, b_parts, b_pages, toc_data = (
+            selections[preferred_format]
+            )
+
+        assemble_path = os.path.join(imposed_dir, book_format, task['slug'])
+        output = os.path.join(imposed_dir, book_format, f"{task['slug']}.pdf")
+
+        toc_pg = None
+        if toc_data is not None:
+            toc_pg, toc_pages = create_toc(
+                ensemble,
+                task['name'],
+                book_format,
+                assemble_path,
+                toc_data,
+                layout=toc_layout,
+                renderer=toc_renderer
+                )
+            a_pages += toc_pages
+
+        # pads the shorter side with blank pages
+        a_blanks = max(0, b_pages - a_pages)
+        b_blanks = max(0, a_pages - b_pages)
+
+        if book_format in MARCHPACK_FORMATS:
+            # both sides are placed straight onto the printed sheets
+            impose_for_printing(
+                impose_side(
+                    a_parts,
+                    a_blanks,
+                    book_format,
+                    toc=toc_pg,
+                    prefix='A'
+                    ),
+                impose_side(
+                    b_parts,
+                    b_blanks,
+                    book_format,
+                    prefix='B'
+                    ),
+                output,
+                template_path
+                )
+        else:
+            impose_and_merge(
+                [
+                    impose_side(
+                        a_parts,
+                        a_blanks,
+                        book_format,
+                        toc=toc_pg,
+                        prefix='A'
+                        ),
+                    impose_side(
+                        b_parts,
+                        b_blanks,
+                        book_format,
+                        prefix='B'
+                        )
+                ],
+                output,
+                book_format
+                )
+
+        # frees this format's table of contents before the next format
+        if toc_pg is not None:
+            toc_pg.close()
+        outputs.append(output)
+
+    page_cache.close()
+    return outputs
+
+
 def merge_marchpacks(
         charts: list,
         source_dir: str,
-        book_format: str
-        ):
+        book_format: str | list[str],
+        template_path: str = TRIM_GUIDES_PATH,
+        jobs: int = 1,
+        toc_layout: str = DEFAULT_CONFIG['toc-layout'],
+        toc_renderer: str = DEFAULT_CONFIG['toc-renderer']
+        ) -> dict[str, str]:
     """
     For each instrument, assembles all parts into a single pdf,
     with a specified order and page size.
+    `book_format` can be a list of formats, in which case each book is
+    imposed in every format in one pass (see impose_book).
+    Marchpacks are printed on the trim guides template at `template_path`.
+
+    Up to `jobs` books are imposed at once, each in its own process.
+    A book that fails to impose is reported, and doesn't stop the others.
+
+    Pages are imposed one at a time straight from their parts, and only one
+    book per job is imposed at a time. Each book's pdf is held in memory
+    until it is written out.
+
+    Tables of contents use the `toc_layout` layout, `standard` or `compact`,
+    and are drawn by the `toc_renderer` renderer, `platypus` or `canvas`.
+
+    Returns:
+        failed (dict): the error for each book that failed, by book name
     """
 
     with open(os.path.join(source_dir, 'book-info.json')) as b:
@@ -460,7 +872,7 @@ def merge_marchpacks(
             a_index[a_id] = create_chart_object(c)
             a_id += 1
         b_index = {}
-        b_id = ((max_id - len(a_index)) + 1)
+        b_id = ((max_id - len(book_info['charts'][1])) + 1)
         for c in book_info['charts'][1]:
             b_index[b_id] = create_chart_object(c)
             b_id += 1
@@ -477,209 +889,53 @@ def merge_marchpacks(
         for c in x_index.values():
             c_list.append(c)
 
-    for instrument in book_info['instruments']:
-        if instrument['div'] == 1:
-            path = os.path.join(raw_dir, instrument['slug'])
-            print(f'merging {instrument["name"]} book')
-
-            a_parts, a_pages = pdf_path_list(
-                path,
-                a_index,
-                book_format,
-                prefix='A'
-                )
-            b_parts, b_pages = pdf_path_list(
-                path,
-                b_index,
-                book_format,
-                prefix='B'
-                )
-
-            assemble_path = (
-                f"{imposed_dir}/{book_format}/{instrument['slug']}"
-                )
-
-            a_pgs = BytesIO()
-            b_pgs = BytesIO()
-            toc_pg = BytesIO()
-
-            if add_toc is True:
-                a_pages += 1
-                toc_data = compile_toc_data(c_list, a_parts, b_parts)
-                toc_pg = create_toc(
-                    book_info['ensemble'],
-                    instrument['name'],
-                    book_format,
-                    assemble_path,
-                    toc_data
-                    )
-
-            if a_pages > b_pages:
-                x_pages = a_pages - b_pages
-                # merge pdfs with blank pages on b side
-                a_pgs = impose_and_merge(
-                    a_parts,
-                    0,
-                    f"{assemble_path}/A.pdf",
-                    book_format,
-                    toc=toc_pg,
-                    prefix='A')
-                b_pgs = impose_and_merge(
-                    b_parts,
-                    x_pages,
-                    f"{assemble_path}/B.pdf",
-                    book_format,
-                    prefix='B')
-
-            else:
-                x_pages = b_pages - a_pages
-                # merge pdfs with blank pages on a side
-                a_pgs = impose_and_merge(
-                    a_parts,
-                    x_pages,
-                    f"{assemble_path}/A.pdf",
-                    book_format,
-                    toc=toc_pg,
-                    prefix='A'
-                    )
-                b_pgs = impose_and_merge(
-                    b_parts,
-                    0,
-                    f"{assemble_path}/B.pdf",
-                    book_format,
-                    prefix='B'
-                    )
+    if isinstance(book_format, str):
+        book_formats = [book_format]
+    else:
+        book_formats = list(book_format)
+
+    tasks = book_tasks(book_info['instruments'], raw_dir)
+    impose = partial(
+        impose_book,
+        a_index=a_index,
+        b_index=b_index,
+        c_list=c_list,
+        ensemble=book_info['ensemble'],
+        book_formats=book_formats,
+        imposed_dir=imposed_dir,
+        library=book_info.get('library'),
+        template_path=template_path,
+        add_toc=add_toc,
+        toc_layout=toc_layout,
+        toc_renderer=toc_renderer
+        )
 
-            pdfname = f'{instrument['slug']}.pdf'
+    failed = {}
 
-            if book_format in MARCHPACK_FORMATS:
-                impose_for_printing(
-                    a_pgs,
-                    b_pgs,
-                    f"{imposed_dir}/{book_format}/{pdfname}"
-                    )
-            else:
-                if os.path.exists(
-                        f"{imposed_dir}/{book_format}/"
-                        ) is False:
-                    os.makedirs(f"{imposed_dir}/{book_format}/")
-                merger = pypdf.PdfWriter()
-
-                for pdf in [
-                        a_pgs,
-                        b_pgs
-                        ]:
-                    merger.append(pdf)
-
-                merger.write(
-                    f"{imposed_dir}/{book_format}/{pdfname}"
-                    )
-                merger.close()
-
-        elif instrument['div'] < 1:
-            raise ValueError("""an instrument can't be divided
-                             into less than one part!
-                            check your ensemble json file!""")
+    def report(n: int, task: dict, error: Exception = None):
+        if error is None:
+            print(f'[{n}/{len(tasks)}] imposed {task["name"]}')
         else:
-            for book in SPLITSORT[instrument['div']]:
-                path = os.path.join(
-                    raw_dir,
-                    instrument['slug'],
-                    book['name']
-                    )
-                print(f"merging{instrument['name']} {book['name']}:")
-
-                a_parts, a_pages = pdf_path_list(
-                    path,
-                    a_index,
-                    book_format,
-                    prefix='A'
-                    )
-                b_parts, b_pages = pdf_path_list(
-                    path,
-                    b_index,
-                    book_format,
-                    prefix='B')
-
-                assemble_path = os.path.join(
-                    imposed_dir,
-                    book_format,
-                    f'{instrument['slug']}{book['name']}'
+            failed[task['name']] = str(error)
+            print(
+                f'[{n}/{len(tasks)}] !!! FAILED {task["name"]}: '
+                f'{type(error).__name__}: {error}'
                 )
 
-                if add_toc is True:
-                    a_pages += 1
-                    toc_data = compile_toc_data(
-                        c_list,
-                        a_parts,
-                        b_parts
-                        )
-                    toc_pg = create_toc(
-                        book_info['ensemble'],
-                        f"{instrument['name']} {book['name']}",
-                        book_format,
-                        assemble_path,
-                        toc_data
-                        )
-
-                if a_pages > b_pages:
-                    x_pages = a_pages - b_pages
-                    # merge pdfs with blank pages on b side
-                    a_pgs = impose_and_merge(
-                        a_parts,
-                        0,
-                        f"{assemble_path}/A.pdf",
-                        book_format,
-                        toc=toc_pg,
-                        prefix='A'
-                        )
-                    b_pgs = impose_and_merge(
-                        b_parts,
-                        x_pages,
-                        f"{assemble_path}/B.pdf",
-                        book_format,
-                        prefix='B'
-                        )
-                else:
-                    x_pages = b_pages - a_pages
-                    # merge pdfs with blank pages on a side
-                    a_pgs = impose_and_merge(
-                        a_parts,
-                        x_pages,
-                        f"{assemble_path}/A.pdf",
-                        book_format,
-                        toc=toc_pg,
-                        prefix='A'
-                        )
-                    b_pgs = impose_and_merge(
-                        b_parts,
-                        0,
-                        f"{assemble_path}/B.pdf",
-                        book_format,
-                        prefix='B'
-                        )
-                pdfname = f'{instrument['slug']}{book['name']}.pdf'
+    if jobs > 1:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            futures = {
+                executor.submit(impose, task): task for task in tasks
+            }
+            for n, future in enumerate(as_completed(futures), start=1):
+                report(n, futures[future], future.exception())
+    else:
+        for n, task in enumerate(tasks, start=1):
+            try:
+                impose(task)
+            except Exception as error:
+                report(n, task, error)
+            else:
+                report(n, task)
 
-                if book_format in MARCHPACK_FORMATS:
-                    impose_for_printing(
-                        a_pgs,
-                        b_pgs,
-                        f"{imposed_dir}/{book_format}/{pdfname}"
-                        )
-                else:
-                    if os.path.exists(
-                            f"{imposed_dir}/{book_format}/"
-                            ) is False:
-                        os.makedirs(f"{imposed_dir}/{book_format}/")
-                    merger = pypdf.PdfWriter()
-
-                    for pdf in [
-                            a_pgs,
-                            b_pgs
-                            ]:
-                        merger.append(pdf)
-
-                    merger.write(
-                        f"{imposed_dir}/{book_format}/{pdfname}"
-                        )
-                    merger.close()
+    return failed
@@ -0,0 +1,375 @@
+"""
+A persistent index of the charts and part files in a magicbook library,
+stored as a single SQLite file in the library directory.
+
+The index records each part file's parsed name, size, mtime, content hash
+and page count, so building and imposing books doesn't have to walk the
+library or open every PDF to find out what's in it. The size and rotation
+of every page are cached by content hash as well, so a changed file is
+never mistaken for its old version.
+"""
+
+import os
+import json
+import sqlite3
+from pathlib import Path
+from typing import NamedTuple
+
+from .library_tools import Chart, hash_file, parse_part_filename
+from .constants import INDEX_FILENAME
+
+INDEX_SCHEMA = """
+CREATE TABLE IF NOT EXISTS charts (
+    slug TEXT PRIMARY KEY,
+    is_single INTEGER NOT NULL,
+    title TEXT
+);
+CREATE TABLE IF NOT EXISTS songs (
+    chart_slug TEXT NOT NULL REFERENCES charts(slug) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    title TEXT,
+    artist TEXT,
+    arranger TEXT,
+    PRIMARY KEY (chart_slug, position)
+);
+CREATE TABLE IF NOT EXISTS parts (
+    chart_slug TEXT NOT NULL REFERENCES charts(slug) ON DELETE CASCADE,
+    filename TEXT NOT NULL,
+    format TEXT,
+    part_slug TEXT,
+    instrument TEXT,
+    part_number INTEGER,
+    size INTEGER NOT NULL,
+    mtime INTEGER NOT NULL,
+    hash TEXT NOT NULL,
+    pages INTEGER,
+    PRIMARY KEY (chart_slug, filename)
+);
+CREATE INDEX IF NOT EXISTS parts_hash ON parts (hash);
+CREATE TABLE IF NOT EXISTS page_geometry (
+    hash TEXT NOT NULL,
+    page INTEGER NOT NULL,
+    mediabox TEXT NOT NULL,
+    cropbox TEXT NOT NULL,
+    rotation INTEGER NOT NULL,
+    PRIMARY KEY (hash, page)
+);
+"""
+
+
+class PageGeometry(NamedTuple):
+    """
+    The boxes (left, bottom, right, top) and rotation of a single pdf page
+    """
+    mediabox: tuple[float, float, float, float]
+    cropbox: tuple[float, float, float, float]
+    rotation: int
+
+
+def open_index(libdir: str, read_only: bool = False) -> sqlite3.Connection:
+    """
+    Opens the library index, creating it if it doesn't exist yet
+    """
+    index_path = os.path.join(libdir, INDEX_FILENAME)
+    if read_only is True:
+        conn = sqlite3.connect(
+            f'{Path(index_path).absolute().as_uri()}?mode=ro',
+            uri=True
+            )
+        conn.row_factory = sqlite3.Row
+        return conn
+    conn = sqlite3.connect(index_path)
+    conn.row_factory = sqlite3.Row
+    conn.execute('PRAGMA foreign_keys = ON')
+    conn.executescript(INDEX_SCHEMA)
+    return conn
+
+
+def read_page_geometry(pdf_path: str) -> list[PageGeometry] | None:
+    """
+    Returns the geometry of every page in a pdf, or None if it can't be read
+    """
+    # pypdf is only needed when a pdf isn't indexed yet
+    import pypdf
+    try:
+        with open(pdf_path, 'rb') as pdf:
+            return [
+                PageGeometry(
+                    tuple(float(x) for x in page.mediabox),
+                    tuple(float(x) for x in page.cropbox),
+                    page.rotation
+                    )
+                for page in pypdf.PdfReader(pdf).pages
+            ]
+    except (OSError, pypdf.errors.PyPdfError):
+        return None
+
+
+def store_page_geometry(
+        conn: sqlite3.Connection,
+        file_hash: str,
+        geometry: list[PageGeometry]
+        ):
+    """
+    Caches the geometry of a pdf's pages, keyed by the pdf's content hash
+    """
+    conn.executemany(
+        'INSERT OR REPLACE INTO page_geometry VALUES (?, ?, ?, ?, ?)',
+        [
+            (file_hash, n, json.dumps(page.mediabox),
+             json.dumps(page.cropbox), page.rotation)
+            for n, page in enumerate(geometry)
+        ]
+    )
+
+
+def index_chart(conn: sqlite3.Connection, chart: Chart):
+    """
+    Adds or replaces a chart and its songs in the index
+    """
+    conn.execute(
+        'INSERT INTO charts (slug, is_single, title) VALUES (?, ?, ?) '
+        'ON CONFLICT (slug) DO UPDATE SET '
+        'is_single = excluded.is_single, title = excluded.title',
+        (chart.slug, chart.is_single, chart.title)
+    )
+    conn.execute('DELETE FROM songs WHERE chart_slug = ?', (chart.slug,))
+    conn.executemany(
+        'INSERT INTO songs VALUES (?, ?, ?, ?, ?)',
+        [
+            (chart.slug, n, song.get('title'), song.get('artist'),
+             song.get('arranger'))
+            for n, song in enumerate(chart.sl)
+        ]
+    )
+
+
+def index_chart_parts(
+        conn: sqlite3.Connection,
+        libdir: str,
+        chart: Chart
+        ) -> tuple[int, int, int]:
+    """
+    Brings the index entries for the PDFs in a chart's directory up to date.
+    Files whose size and mtime haven't changed are skipped, so only new or
+    modified files are hashed and have their pages counted.
+
+    Returns:
+        the number of part files added, updated and removed
+    """
+    added = 0
+    updated = 0
+    indexed = {
+        row['filename']: row
+        for row in conn.execute(
+            'SELECT filename, size, mtime FROM parts WHERE chart_slug = ?',
+            (chart.slug,)
+        )
+    }
+    found = set()
+    if os.path.isdir(chart.path(libdir)):
+        entries = list(os.scandir(chart.path(libdir)))
+    else:
+        entries = []
+    for entry in entries:
+        if not entry.is_file() or not entry.name.endswith('.pdf'):
+            continue
+        found.add(entry.name)
+        stat = entry.stat()
+        row = indexed.get(entry.name)
+        if row is not None and (
+                row['size'] == stat.st_size
+                and row['mtime'] == stat.st_mtime_ns
+                ):
+            continue
+        part = parse_part_filename(entry.name)
+        file_hash = hash_file(entry.path)
+        geometry = indexed_geometry(conn, file_hash)
+        if geometry is None:
+            geometry = read_page_geometry(entry.path)
+            if geometry is not None:
+                store_page_geometry(conn, file_hash, geometry)
+        conn.execute(
+            'INSERT OR REPLACE INTO parts VALUES '
+            '(?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            (
+                chart.slug,
+                entry.name,
+                part.format if part is not None else None,
+                part.part_slug if part is not None else None,
+                part.instrument if part is not None else None,
+                part.part_number if part is not None else None,
+                stat.st_size,
+                stat.st_mtime_ns,
+                file_hash,
+                len(geometry) if geometry is not None else None
+            )
+        )
+        if row is None:
+            added += 1
+        else:
+            updated += 1
+    removed = indexed.keys() - found
+    conn.executemany(
+        'DELETE FROM parts WHERE chart_slug = ? AND filename = ?',
+        [(chart.slug, filename) for filename in removed]
+    )
+    return added, updated, len(removed)
+
+
+def update_index(
+        libdir: str,
+        charts: list[Chart],
+        rebuild: bool = False,
+        prune: bool = True
+        ) -> tuple[int, int, int]:
+    """
+    Updates the library index for a list of charts.
+
+    Args:
+        libdir: path pointing to the library directory
+        charts: the charts to index
+        rebuild: discards the existing index and indexes every file again
+        prune: removes charts that aren't in the list from the index
+
+    Returns:
+        the number of part files added, updated and removed
+    """
+    totals = [0, 0, 0]
+    conn = open_index(libdir)
+    with conn:
+        if rebuild is True:
+            conn.execute('DELETE FROM charts')
+        elif prune is True:
+            slugs = [chart.slug for chart in charts]
+            conn.execute(
+                'DELETE FROM charts WHERE slug NOT IN '
+                f'({", ".join("?" for s in slugs)})',
+                slugs
+            )
+        for chart in charts:
+            index_chart(conn, chart)
+            counts = index_chart_parts(conn, libdir, chart)
+            for n in range(0, 3):
+                totals[n] += counts[n]
+        if rebuild is True or prune is True:
+            conn.execute(
+                'DELETE FROM page_geometry '
+                'WHERE hash NOT IN (SELECT hash FROM parts)'
+            )
+    conn.close()
+    return tuple(totals)
+
+
+def indexed_parts(
+        conn: sqlite3.Connection,
+        chart_slug: str
+        ) -> list[sqlite3.Row]:
+    """
+    Returns the index entries for every PDF in a chart's directory
+    """
+    return conn.execute(
+        'SELECT * FROM parts WHERE chart_slug = ? ORDER BY filename',
+        (chart_slug,)
+    ).fetchall()
+
+
+def chart_page_counts(conn: sqlite3.Connection) -> dict[str, int]:
+    """
+    Returns the typical page count of every indexed chart, keyed by chart
+    slug: the page count most of its LYRE parts have, or most of its parts
+    if it has no LYRE parts
+    """
+    counts = {}
+    for row in conn.execute(
+            'SELECT chart_slug, format, pages, COUNT(*) AS n FROM parts '
+            'WHERE pages IS NOT NULL GROUP BY chart_slug, format, pages'
+            ):
+        chart = counts.setdefault(row['chart_slug'], {'LYRE': {}, 'all': {}})
+        if row['format'] == 'LYRE':
+            chart['LYRE'][row['pages']] = row['n']
+        chart['all'][row['pages']] = (
+            chart['all'].get(row['pages'], 0) + row['n']
+            )
+    page_counts = {}
+    for slug, chart in counts.items():
+        found = chart['LYRE'] or chart['all']
+        page_counts[slug] = max(found, key=lambda pages: (found[pages], pages))
+    return page_counts
+
+
+def indexed_geometry(
+        conn: sqlite3.Connection,
+        file_hash: str
+        ) -> list[PageGeometry] | None:
+    """
+    Returns the cached geometry of every page of the pdf with the given
+    content hash, or None if it isn't cached
+    """
+    rows = conn.execute(
+        'SELECT mediabox, cropbox, rotation FROM page_geometry '
+        'WHERE hash = ? ORDER BY page',
+        (file_hash,)
+    ).fetchall()
+    if len(rows) == 0:
+        return None
+    return [
+        PageGeometry(
+            tuple(json.loads(row['mediabox'])),
+            tuple(json.loads(row['cropbox'])),
+            row['rotation']
+            )
+        for row in rows
+    ]
+
+
+class PageCache:
+    """
+    Looks up the page count and page geometry of pdfs by content hash.
+
+    Geometry is read from the index of the library at `libdir`, and pdfs
+    that aren't cached yet are parsed once and added to it. Without a
+    library, the cache only lasts as long as the object. Since entries are
+    keyed by content hash, a file that changes is simply parsed again.
+    """
+    def __init__(self, libdir: str = None):
+        self.libdir = libdir
+        self._conn = None
+        self._geometry = {}
+
+    def _index(self) -> sqlite3.Connection | None:
+        if self._conn is None and self.libdir is not None:
+            self._conn = open_index(self.libdir)
+        return self._conn
+
+    def geometry(self, pdf_path: str) -> list[PageGeometry]:
+        """
+        Returns the geometry of every page in a pdf
+        """
+        file_hash = hash_file(pdf_path)
+        if file_hash in self._geometry:
+            return self._geometry[file_hash]
+        conn = self._index()
+        geometry = None
+        if conn is not None:
+            geometry = indexed_geometry(conn, file_hash)
+        if geometry is None:
+            geometry = read_page_geometry(pdf_path)
+            if geometry is None:
+                raise ValueError(f'unable to read pdf {pdf_path}')
+            if conn is not None:
+                with conn:
+                    store_page_geometry(conn, file_hash, geometry)
+        self._geometry[file_hash] = geometry
+        return geometry
+
+    def page_count(self, pdf_path: str) -> int:
+        """
+        Returns the number of pages in a pdf
+        """
+        return len(self.geometry(pdf_path))
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
@@ -1,11 +1,14 @@
 import os
 import re
 import json
-import jsonschema
+import hashlib
+from typing import NamedTuple
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 
-from rich.progress import track
 
-from .constants import PAGE_FORMATS
+from .constants import PAGE_FORMATS, AUDIT_CACHE_FILENAME
+from .schema_tools import ChartValidator
 
 
 class Song:
@@ -78,20 +81,147 @@ def list_charts(lib: list[Chart]) -> list[str]:
     return chart_list
 
 
-def strip_part_filename(
-        file,
-        chart_name
-        ) -> str:
+class PartFile(NamedTuple):
     """
-    returns only the name of the part (no chart name or .pdf)
+    A part file in the library, named
+    (chart-slug) (FORMAT) (part-slug).pdf
+    where the part slug is the instrument slug,
+    followed by the part number for split parts
     """
-    part_core = str(file).removeprefix(chart_name).removesuffix(".pdf")
-    for format in PAGE_FORMATS:
-        if format in part_core:
-            return part_core.removeprefix(
-                f" {format} "
+    filename: str
+    chart_slug: str
+    format: str
+    part_slug: str
+    instrument: str
+    part_number: int | None
+
+
+PART_FILENAME = re.compile(
+    r'^(?P<chart>\S+) (?P<format>' + '|'.join(PAGE_FORMATS) + r') '
+    r'(?P<part>(?P<instrument>\S+?)(?P<number>\d*))\.pdf$'
+)
+
+
+def parse_part_filename(file: str) -> PartFile | None:
+    """
+    Parses the filename of a part into a PartFile,
+    returns None if the filename doesn't follow the part naming scheme
+    """
+    match = PART_FILENAME.match(str(file))
+    if match is None:
+        return None
+    number = match['number']
+    return PartFile(
+        str(file),
+        match['chart'],
+        match['format'],
+        match['part'],
+        match['instrument'],
+        int(number) if number != '' else None
+    )
+
+
+class ChartParts:
+    """
+    The part files of a single chart, keyed by
+    (instrument slug, part number, page format)
+    so parts are found with a dictionary lookup instead of searching
+    filenames. Files that don't follow the part naming scheme, or belong
+    to a different chart, are ignored.
+    """
+    def __init__(self, chart_slug: str, files: list[str | PartFile]):
+        self.chart_slug = chart_slug
+        self.parts = {}
+        self.numbers = {}
+        for file in files:
+            if isinstance(file, PartFile):
+                part = file
+            else:
+                part = parse_part_filename(file)
+            if part is None or part.chart_slug != chart_slug:
+                continue
+            self.parts[
+                (part.instrument, part.part_number, part.format)
+            ] = part
+            self.numbers.setdefault(part.instrument, set()).add(
+                part.part_number
                 )
-    return part_core
+
+    def get(
+            self,
+            instrument: str,
+            part_number: int | None,
+            format: str
+            ) -> PartFile | None:
+        """
+        Returns the part file for an instrument, part number and format
+        """
+        return self.parts.get((instrument, part_number, format))
+
+    def part_numbers(self, instrument: str) -> list[int | None]:
+        """
+        Returns the part numbers available for an instrument,
+        with an unnumbered part first
+        """
+        return sorted(
+            self.numbers.get(instrument, ()),
+            key=lambda n: -1 if n is None else n
+            )
+
+    def select_format(
+            self,
+            preferred_format: str,
+            other_format: str
+            ) -> tuple[list[PartFile], list[PartFile]]:
+        """
+        Picks one file for every part of the chart, in the preferred format
+        if there is one, otherwise in the other format.
+
+        Returns:
+            the parts found in the preferred format,
+            and the parts only found in the other format
+        """
+        prefer_find = []
+        other_find = []
+        for instrument in self.numbers:
+            for number in self.part_numbers(instrument):
+                part = self.get(instrument, number, preferred_format)
+                if part is not None:
+                    prefer_find.append(part)
+                    continue
+                part = self.get(instrument, number, other_format)
+                if part is not None:
+                    other_find.append(part)
+        return prefer_find, other_find
+
+    def instrument_parts(self, instrument: str) -> list[PartFile]:
+        """
+        Returns every part file for an instrument, in every format
+        """
+        found = []
+        for number in self.part_numbers(instrument):
+            for format in PAGE_FORMATS:
+                part = self.get(instrument, number, format)
+                if part is not None:
+                    found.append(part)
+        return found
+
+
+def group_part_files(files: list[str]) -> dict[str, ChartParts]:
+    """
+    Given the filenames in a directory holding parts for several charts,
+    parses each filename once and returns the parts of each chart,
+    keyed by chart slug
+    """
+    grouped = {}
+    for file in sorted(files):
+        part = parse_part_filename(file)
+        if part is not None:
+            grouped.setdefault(part.chart_slug, []).append(part)
+    return {
+        chart_slug: ChartParts(chart_slug, parts)
+        for chart_slug, parts in grouped.items()
+    }
 
 
 def show_chart_details(chart, lib):
@@ -174,41 +304,126 @@ def chart_missing_parts(
                 break
 
 
-def audit_chart_json(chart: str, infopath: str, scmpath: str):
+def hash_file(path: str) -> str:
     """
-    Validates a chart's info.json file against the schema
+    Returns the sha256 hex digest of a file's contents
     """
-    with open(scmpath) as schema:
-        chartschema = json.load(schema)
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def load_audit_cache(libdir: str, schema_hash: str) -> dict:
+    """
+    Loads the audit cache stored in the library directory.
+    Returns an empty cache if there is no cache file, if it can't be read,
+    or if it was created with a different chart schema.
+    """
+    cache_path = os.path.join(libdir, AUDIT_CACHE_FILENAME)
+    if not os.path.isfile(cache_path):
+        return {}
+    try:
+        with open(cache_path) as cache_file:
+            cache = json.load(cache_file)
+    except (OSError, ValueError):
+        return {}
+    if cache.get('schema') != schema_hash:
+        return {}
+    return cache.get('charts', {})
+
+
+def save_audit_cache(libdir: str, schema_hash: str, charts: dict):
+    """
+    Writes the audit cache to the library directory
+    """
+    cache_path = os.path.join(libdir, AUDIT_CACHE_FILENAME)
+    with open(f'{cache_path}.tmp', 'w') as cache_file:
+        json.dump({'schema': schema_hash, 'charts': charts}, cache_file)
+    os.replace(f'{cache_path}.tmp', cache_path)
+
+
+def audit_chart_cached(
+        infopath: str,
+        validator: ChartValidator,
+        cached: dict = None
+        ) -> dict:
+    """
+    Returns the audit cache entry for a chart's info.json file.
+    The cached entry is reused if the file's mtime and size are unchanged,
+    or if its contents still hash to the same value. Otherwise the file is
+    validated against the schema again.
+    """
+    stat = os.stat(infopath)
+    if cached is not None and (
+            cached['mtime'] == stat.st_mtime_ns
+            and cached['size'] == stat.st_size
+            ):
+        return cached
+
+    info_hash = hash_file(infopath)
+    if cached is not None and cached['hash'] == info_hash:
+        return cached | {'mtime': stat.st_mtime_ns, 'size': stat.st_size}
+
     with open(infopath) as info:
         chartinfo = json.load(info)
-    try:
-        jsonschema.validate(instance=chartinfo, schema=chartschema)
-    except Exception as err:
-        print(f'{chart} info.json falied validation')
-        print(err)
-        return False, None
-    else:
-        # print(
-        #     f'{chart} info.json passed validation'
-        # )
-        chart_obj = Chart(chartinfo['slug'],
-                          chartinfo['is_single'],
-                          chartinfo['songs'],
-                          t=chartinfo.get('title'))
-        return True, chart_obj
+    error = validator.validate(chartinfo)
+    entry = {
+        'mtime': stat.st_mtime_ns,
+        'size': stat.st_size,
+        'hash': info_hash,
+        'valid': error is None,
+        'info': chartinfo if error is None else None,
+        'error': error
+    }
+    return entry
+
+
+def audit_chart_dir(
+        libdir: str,
+        validator: ChartValidator,
+        chart: str,
+        cached: dict = None
+        ) -> dict | bool | None:
+    """
+    Audits a single entry of the library directory.
+
+    Returns:
+        None if the entry isn't a chart directory, False if the chart
+        is missing its info.json file, otherwise the chart's audit cache entry
+    """
+    chartpath = os.path.join(libdir, chart)
+    infopath = os.path.join(chartpath, "info.json")
+    if not os.path.isdir(chartpath):
+        return None
+    if not os.path.isfile(infopath):
+        return False
+    return audit_chart_cached(infopath, validator, cached)
 
 
 def audit_library(
         libdir: str,
-        scmpath: str
+        scmpath: str,
+        full_audit: bool = False,
+        jobs: int = 1,
+        pool: str = 'thread'
         ) -> bool | int | int | list[Chart]:
     """
     Checks each chart in the library for a valid info.json file
 
+    Results are stored in an audit cache in the library directory, so only
+    charts with a new or changed info.json file are validated again on the
+    next run. The schema is compiled once, and only if a chart needs to be
+    validated.
+
     Args:
         libdir: path pointing to the library directory
         schmdir: path pointing to the schema directory
+        full_audit: ignores the audit cache and validates every chart
+        jobs: number of charts to audit in parallel
+        pool: 'thread' (best for libraries on a network share) or 'process'
+          (best for CPU-bound validation of large libraries)
 
     Returns:
         bool: True if all charts pass audit, False if any fail
@@ -220,24 +435,64 @@ def audit_library(
     x = 0
     t = 0
     chart_list = []
-    for chart in track(
-            sorted(os.listdir(libdir)),
-            description='Auditing library'
+    schema_hash = hash_file(scmpath)
+    if full_audit is True:
+        cache = {}
+    else:
+        cache = load_audit_cache(libdir, schema_hash)
+    validator = ChartValidator(scmpath)
+    audited = {}
+
+    # hidden directories, like .git, aren't charts
+    charts = sorted(
+        chart for chart in os.listdir(libdir) if not chart.startswith('.')
+        )
+    audit = partial(audit_chart_dir, libdir, validator)
+    cached = [cache.get(chart) for chart in charts]
+
+    if jobs > 1 and pool == 'process':
+        executor = ProcessPoolExecutor(max_workers=jobs)
+        results = executor.map(
+            audit,
+            charts,
+            cached,
+            chunksize=max(1, len(charts) // (jobs * 4))
+            )
+    elif jobs > 1:
+        executor = ThreadPoolExecutor(max_workers=jobs)
+        results = executor.map(audit, charts, cached)
+    else:
+        executor = None
+        results = map(audit, charts, cached)
+
+    # imported here, as rich.progress is slow to import and only the
+    # audit shows a progress bar
+    from rich.progress import track
+
+    # results are received in the same order as the charts, so failures
+    # are reported in the same order no matter how many jobs are used
+    for entry, chart in zip(
+            track(results, total=len(charts), description='Auditing library'),
+            charts
             ):
-        chartpath = os.path.join(libdir, chart)
-        infopath = os.path.join(chartpath, "info.json")
-        if os.path.isdir(chartpath):
-            t += 1
-            if os.path.isfile(infopath):
-                r, chart_obj = audit_chart_json(chart, infopath, scmpath)
-                if r is True:
-                    chart_list.append(chart_obj)
-                    continue
-                else:
-                    x += 1
-            else:
-                x += 1
-                print(f'{chart} is missing info.json file')
+        if entry is None:
+            continue
+        t += 1
+        if entry is False:
+            x += 1
+            print(f'{chart} is missing info.json file')
+            continue
+        audited[chart] = entry
+        if entry['valid'] is True:
+            chart_list.append(create_chart_object(entry['info']))
+        else:
+            print(f'{chart} info.json falied validation')
+            print(entry['error'])
+            x += 1
+
+    if executor is not None:
+        executor.shutdown()
+    save_audit_cache(libdir, schema_hash, audited)
     if x == 0:
         return True, x, t, chart_list
     else:
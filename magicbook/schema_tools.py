@@ -0,0 +1,222 @@
+"""
+Validation of chart info.json files against the chart schema.
+
+The schema is loaded and compiled into a single validator the first time it
+is needed, and that validator is reused for every chart in the library.
+jsonschema is only imported then, so an audit answered entirely from the
+audit cache never loads it.
+"""
+
+import json
+
+from .constants import DEFAULT_SCHEMA
+
+# keywords that only annotate a schema, and never affect validation
+ANNOTATION_KEYWORDS = (
+    '$schema',
+    '$comment',
+    'title',
+    'description',
+    'default',
+    'examples'
+)
+
+FAST_PATH_KEYWORDS = (
+    'type',
+    'properties',
+    'required',
+    'items',
+    'minItems',
+    'maxItems',
+    'uniqueItems'
+)
+
+# type checks matching the draft 2020-12 jsonschema type checker
+TYPE_CHECKS = {
+    'array': 'isinstance({v}, list)',
+    'boolean': 'isinstance({v}, bool)',
+    'integer': (
+        '((isinstance({v}, int) and not isinstance({v}, bool))'
+        ' or (isinstance({v}, float) and {v}.is_integer()))'
+    ),
+    'null': '{v} is None',
+    'number': (
+        '(isinstance({v}, (int, float)) and not isinstance({v}, bool))'
+    ),
+    'object': 'isinstance({v}, dict)',
+    'string': 'isinstance({v}, str)'
+}
+
+
+class UnsupportedSchema(Exception):
+    """
+    Raised when a schema uses keywords the fast path can't compile
+    """
+    pass
+
+
+def _json_equal(one, two) -> bool:
+    """
+    Compares two JSON values the way jsonschema does,
+    so True and 1 are not considered equal
+    """
+    if isinstance(one, bool) or isinstance(two, bool):
+        return isinstance(one, bool) and isinstance(two, bool) and one == two
+    if isinstance(one, list) and isinstance(two, list):
+        return len(one) == len(two) and all(
+            _json_equal(a, b) for a, b in zip(one, two)
+        )
+    if isinstance(one, dict) and isinstance(two, dict):
+        return one.keys() == two.keys() and all(
+            _json_equal(one[key], two[key]) for key in one
+        )
+    return one == two
+
+
+def _unique(items: list) -> bool:
+    """
+    Returns True if no two items in the list are equal
+    """
+    for i, item in enumerate(items):
+        for other in items[i + 1:]:
+            if _json_equal(item, other):
+                return False
+    return True
+
+
+def _emit_schema(schema, var: str, depth: int, lines: list, indent: str):
+    """
+    Appends the lines of Python code checking the value in `var` against
+    `schema` to `lines`. Each failing check returns False.
+    """
+    if schema is True:
+        return
+    if schema is False:
+        lines.append(f'{indent}return False')
+        return
+    if not isinstance(schema, dict):
+        raise UnsupportedSchema(f'schema must be an object, not {schema!r}')
+
+    for keyword in schema:
+        if keyword not in FAST_PATH_KEYWORDS + ANNOTATION_KEYWORDS:
+            raise UnsupportedSchema(f'unsupported keyword {keyword}')
+
+    if 'type' in schema:
+        types = schema['type']
+        if isinstance(types, str):
+            types = [types]
+        for t in types:
+            if t not in TYPE_CHECKS:
+                raise UnsupportedSchema(f'unknown type {t}')
+        check = ' or '.join(TYPE_CHECKS[t].format(v=var) for t in types)
+        lines.append(f'{indent}if not ({check}):')
+        lines.append(f'{indent}    return False')
+
+    if 'required' in schema or 'properties' in schema:
+        lines.append(f'{indent}if isinstance({var}, dict):')
+        body_start = len(lines)
+        for key in schema.get('required', []):
+            lines.append(f'{indent}    if {key!r} not in {var}:')
+            lines.append(f'{indent}        return False')
+        child = f'v{depth + 1}'
+        for key, subschema in schema.get('properties', {}).items():
+            lines.append(f'{indent}    if {key!r} in {var}:')
+            lines.append(f'{indent}        {child} = {var}[{key!r}]')
+            _emit_schema(
+                subschema,
+                child,
+                depth + 1,
+                lines,
+                f'{indent}        '
+                )
+        if len(lines) == body_start:
+            lines.append(f'{indent}    pass')
+
+    if any(k in schema for k in ('items', 'minItems', 'maxItems',
+                                 'uniqueItems')):
+        lines.append(f'{indent}if isinstance({var}, list):')
+        if 'minItems' in schema:
+            lines.append(f'{indent}    if len({var}) < {schema["minItems"]}:')
+            lines.append(f'{indent}        return False')
+        if 'maxItems' in schema:
+            lines.append(f'{indent}    if len({var}) > {schema["maxItems"]}:')
+            lines.append(f'{indent}        return False')
+        if schema.get('uniqueItems') is True:
+            lines.append(f'{indent}    if not _unique({var}):')
+            lines.append(f'{indent}        return False')
+        if 'items' in schema:
+            child = f'v{depth + 1}'
+            lines.append(f'{indent}    for {child} in {var}:')
+            body_start = len(lines)
+            _emit_schema(
+                schema['items'],
+                child,
+                depth + 1,
+                lines,
+                f'{indent}        '
+                )
+            if len(lines) == body_start:
+                lines.append(f'{indent}        pass')
+        else:
+            lines.append(f'{indent}    pass')
+
+
+def compile_fast_validator(schema: dict):
+    """
+    Generates and compiles a Python function that returns True if a chart's
+    info.json data is valid against the schema, and False if it isn't.
+    Only a small subset of JSON schema is supported, enough for the
+    DEFAULT_SCHEMA shipped with magicbook. Raises UnsupportedSchema for
+    anything else.
+    """
+    lines = ['def fast_validate(v0):']
+    _emit_schema(schema, 'v0', 0, lines, '    ')
+    lines.append('    return True')
+    namespace = {'_unique': _unique}
+    exec(compile('\n'.join(lines), '<chart-schema>', 'exec'), namespace)
+    return namespace['fast_validate']
+
+
+class ChartValidator:
+    """
+    Validates chart info.json data against the schema stored at `scmpath`.
+    The schema is read, checked and compiled once, on first use.
+
+    If `fast_path` is True and the schema is the DEFAULT_SCHEMA, charts are
+    first checked with a generated validator. The full jsonschema validator
+    is only used to report errors for charts that fail the fast check, so
+    both paths always give the same verdict.
+    """
+    def __init__(self, scmpath: str, fast_path: bool = True):
+        self.scmpath = scmpath
+        self.fast_path = fast_path
+        self._validator = None
+        self._fast_validate = None
+
+    def _compile(self):
+        import jsonschema
+        with open(self.scmpath) as schema:
+            chartschema = json.load(schema)
+        validator_class = jsonschema.validators.validator_for(chartschema)
+        validator_class.check_schema(chartschema)
+        self._validator = validator_class(chartschema)
+        if self.fast_path is True and chartschema == DEFAULT_SCHEMA:
+            self._fast_validate = compile_fast_validator(chartschema)
+
+    def validate(self, chartinfo: dict) -> str | None:
+        """
+        Returns None if the chart info is valid,
+        otherwise returns the validation error message
+        """
+        if self._validator is None:
+            self._compile()
+        if self._fast_validate is not None:
+            if self._fast_validate(chartinfo) is True:
+                return None
+        import jsonschema
+        error = jsonschema.exceptions.best_match(
+            self._validator.iter_errors(chartinfo)
+            )
+        if error is None:
+            return None
+        return str(error)
@@ -1,8 +1,8 @@
 import os
+from typing import Callable
 
 from rich.console import Console
 from rich.table import Table
-from simple_term_menu import TerminalMenu
 
 from .library_tools import Chart, list_charts
 from .book_tools import list_books
@@ -12,6 +12,9 @@ from .constants import (
     BINDER_FORMATS
     )
 
+# simple_term_menu is imported by the prompts that use it, so commands that
+# only print to the console start without it
+
 
 def display_book_list(output_dir: str):
     """
@@ -59,6 +62,7 @@ def lib_single_query(loc, pageid="", prefix=None):
     prompts the user to select a single chart from a list of charts
     optional input to specify the page ID
     """
+    from simple_term_menu import TerminalMenu
     if prefix is None:
         pre = ""
     else:
@@ -78,13 +82,20 @@ def lib_single_query(loc, pageid="", prefix=None):
 
 def assemble_book_questions(
         ensemble_info: dict,
-        charts_list: list[Chart]
+        charts_list: list[Chart],
+        count_pages: Callable[[list[Chart]], dict[str, int]] = None
         ) -> tuple[
             list[list[Chart]],
             tuple[bool, int, bool]
             ]:
     """
+    Asks which charts go in the books and how they are ordered.
+    If a `count_pages` function is provided, march pack charts can be
+    split between the A and B sides by page count instead of chart count,
+    so the shorter side needs less padding. It's only called with the
+    selected charts, and only if the user asks for the split.
     """
+    from simple_term_menu import TerminalMenu
     if len(charts_list) < 1:
         print(
             "No charts found in the library.\n"
@@ -164,7 +175,39 @@ def assemble_book_questions(
             print("Invalid input. Please try again.")
     charts_rem = selected_charts_list.copy()
 
-    if custom_order is True:
+    balance = False
+    if abside is True and count_pages is not None:
+        print(
+            'Split the charts between the A and B sides by page count?\n'
+            'This keeps the chart order, but can save sheets of paper '
+            'when charts have different lengths.'
+            )
+        balance = (input("y/n: ") == 'y')
+
+    if balance is True:
+        if custom_order is True:
+            print(
+                "Select charts in order from first to last"
+            )
+            ordered_charts = []
+            for i in range(0, len(selected_charts_list)):
+                chart = lib_single_query(
+                    charts_rem,
+                    pageid=f"{i + 1}"
+                    )
+                charts_rem.remove(chart)
+                ordered_charts.append(chart)
+        else:
+            ordered_charts = charts_rem
+        from .imposition_tools import auto_order_charts
+        sorted_charts = auto_order_charts(
+            ordered_charts,
+            abside,
+            pages=count_pages(ordered_charts),
+            max_id=max_id
+            )
+
+    elif custom_order is True:
         if abside is True:
             book_pages = (len(charts_rem) // 2)
             book_rem = (len(charts_rem) % 2)
@@ -186,7 +229,7 @@ def assemble_book_questions(
                 "Select charts for 'B' side, in order from first to last"
             )
             b_index = {}
-            b_id = ((max_id - book_pages) + 1)
+            b_id = ((max_id - (book_pages + book_rem)) + 1)
             for i in range(0, book_pages + book_rem):
                 chart = lib_single_query(
                     charts_rem,
@@ -229,7 +272,7 @@ def assemble_book_questions(
                 a_index[a_id] = chart
                 a_id += 1
             b_index = {}
-            b_id = ((max_id - book_pages) + 1)
+            b_id = ((max_id - (book_pages + book_rem)) + 1)
             for i in range(0, (book_pages + book_rem)):
                 chart = charts_rem[0]
                 charts_rem.remove(chart)
@@ -256,6 +299,7 @@ def assemble_book_questions(
 def impose_choose_ensemble(
         output_dir: str,
         ):
+    from simple_term_menu import TerminalMenu
     output_ensembles = []
     for dir in os.listdir(output_dir):
         output_ensembles.append(dir)
@@ -276,6 +320,7 @@ def impose_choose_book(
         output_dir: str,
         ensemble_slug: str
 ):
+    from simple_term_menu import TerminalMenu
     books_menu = []
     for dir in os.listdir(os.path.join(output_dir, ensemble_slug)):
         books_menu.append(dir)
@@ -293,6 +338,7 @@ def impose_choose_book(
 
 
 def choose_format_questions():
+    from simple_term_menu import TerminalMenu
     format_list = []
     for category in [MARCHPACK_FORMATS, BINDER_FORMATS]:
         for format in category:
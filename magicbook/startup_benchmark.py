@@ -0,0 +1,204 @@
+"""
+Measures how long magicbook takes to start for commands that shouldn't
+need its heavy dependencies, using `python -X importtime`.
+
+Each command is run several times in a fresh interpreter, and the fastest
+run's total import time is compared to a budget. The command also fails if
+it exits with an error, if no import time report is found, or if it imports
+any of HEAVY_MODULES, which are only needed to impose books or validate
+charts. tests/test_startup.py runs the same checks. Run it with:
+
+    python -m magicbook.startup_benchmark [--path LIBRARY] [--budget-ms MS]
+
+It exits with status 1 if any command fails a check, so it can be used as
+a check before a release.
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+from typing import NamedTuple
+
+# modules the cheap commands must start without
+HEAVY_MODULES = ('pypdf', 'reportlab', 'jsonschema', 'simple_term_menu')
+
+DEFAULT_BUDGET_MS = 300
+DEFAULT_RUNS = 5
+
+
+class StartupTime(NamedTuple):
+    """
+    The imports of a single run of a command, and its exit status
+    """
+    total_us: int
+    imports: dict[str, int]
+    modules: set[str]
+    returncode: int = 0
+
+
+def parse_importtime(stderr: str) -> StartupTime:
+    """
+    Reads the `-X importtime` report from a command's stderr.
+
+    Returns:
+        the total import time in microseconds, the cumulative time of each
+        top level import, and the name of every module imported
+    """
+    total = 0
+    imports = {}
+    modules = set()
+    for line in stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        fields = line[len('import time:'):].split('|')
+        if len(fields) != 3 or not fields[1].strip().isdigit():
+            # the report's header
+            continue
+        name = fields[2].rstrip()
+        module = name.strip()
+        modules.add(module)
+        # top level imports are the only ones not indented past one space
+        if not name.startswith('  '):
+            cumulative = int(fields[1])
+            imports[module] = cumulative
+            total += cumulative
+    return StartupTime(total, imports, modules)
+
+
+def time_command(
+        args: list[str],
+        runs: int = DEFAULT_RUNS,
+        module: str = 'magicbook'
+        ) -> StartupTime:
+    """
+    Runs `python -m magicbook` (or another module) with the given arguments
+    `runs` times, each in a fresh interpreter.
+
+    Returns:
+        the fastest run, or the first run that exits with an error
+    """
+    env = dict(os.environ, PYTHONDONTWRITEBYTECODE='1')
+    fastest = None
+    for n in range(0, runs):
+        result = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-m', module] + args,
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+            text=True,
+            env=env
+            )
+        timing = parse_importtime(result.stderr)._replace(
+            returncode=result.returncode
+            )
+        if result.returncode != 0:
+            return timing
+        if fastest is None or timing.total_us < fastest.total_us:
+            fastest = timing
+    return fastest
+
+
+def heavy_modules(modules: set[str]) -> list[str]:
+    """
+    Returns the HEAVY_MODULES found in a set of module names
+    """
+    return sorted(
+        heavy for heavy in HEAVY_MODULES
+        if any(
+            module == heavy or module.startswith(f'{heavy}.')
+            for module in modules
+            )
+    )
+
+
+def startup_problems(timing: StartupTime, budget_ms: float) -> list[str]:
+    """
+    Returns a description of every check a command's run failed
+    """
+    problems = []
+    if timing.returncode != 0:
+        problems.append(f'exited with status {timing.returncode}')
+    if len(timing.imports) == 0:
+        problems.append('no import time report was found')
+    if timing.total_us / 1000 > budget_ms:
+        problems.append(f'imports took over {budget_ms:.0f} ms')
+    heavy = heavy_modules(timing.modules)
+    if len(heavy) > 0:
+        problems.append(f'imports heavy modules: {", ".join(heavy)}')
+    return problems
+
+
+def cheap_commands(library: str = None) -> dict[str, list[str]]:
+    """
+    Returns the arguments of each command to measure. Commands that read a
+    library are only included if a library is given.
+    """
+    commands = {'--help': ['--help']}
+    if library is not None:
+        commands['charts list'] = ['--path', library, 'charts', 'list']
+        commands['books list'] = ['--path', library, 'books', 'list']
+    return commands
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(
+        prog='python -m magicbook.startup_benchmark',
+        description=(
+            'Measures the import time of magicbook commands that should '
+            'start quickly'
+        )
+    )
+    parser.add_argument(
+        '--path',
+        type=str,
+        metavar='LIBRARY',
+        help='A magicbook library, to also measure commands that read it'
+    )
+    parser.add_argument(
+        '--budget-ms',
+        type=float,
+        default=DEFAULT_BUDGET_MS,
+        metavar='MS',
+        help='The most import time a command may take'
+    )
+    parser.add_argument(
+        '--runs',
+        type=int,
+        default=DEFAULT_RUNS,
+        metavar='N',
+        help='Number of times to run each command, keeping the fastest'
+    )
+    args = parser.parse_args()
+
+    failures = 0
+    for name, command in cheap_commands(args.path).items():
+        timing = time_command(command, runs=args.runs)
+        total_ms = timing.total_us / 1000
+        problems = startup_problems(timing, args.budget_ms)
+        status = 'ok'
+        if len(problems) > 0:
+            status = 'FAILED'
+            failures += 1
+        print(
+            f'{name}: {total_ms:.1f} ms of imports '
+            f'(budget {args.budget_ms:.0f} ms) {status}'
+            )
+        slowest = sorted(
+            timing.imports.items(),
+            key=lambda item: item[1],
+            reverse=True
+            )
+        for module, cumulative in slowest[:5]:
+            print(f'   {cumulative / 1000:8.1f} ms  {module}')
+        for problem in problems:
+            print(f'   {problem}')
+
+    if failures > 0:
+        print(f'{failures} command(s) failed the startup benchmark')
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -25,11 +25,14 @@ from reportlab.lib.styles import (
 from reportlab.lib.pagesizes import (
     letter
 )
+from reportlab.pdfbase.pdfmetrics import stringWidth
+from reportlab.pdfgen import canvas
 from .library_tools import (
     Chart,
     # Song
 )
-from functools import partial
+from functools import lru_cache, partial
+from typing import NamedTuple
 from .constants import (
     LYRE_PAPER_X,
     LYRE_PAPER_Y,
@@ -40,13 +43,15 @@ from .constants import (
     LETTER_MARGIN_Y,
     MARCHPACK_FORMATS,
     BINDER_FORMATS,
+    TOC_LAYOUTS,
+    TOC_RENDERERS,
 )
 
 
 def compile_toc_data(
         charts: list[Chart],
-        a_parts: dict,
-        b_parts: dict
+        a_parts: list,
+        b_parts: list
         ) -> list[list]:
     '''
     Given a list of charts in a book, and a list of the available
@@ -62,40 +67,87 @@ def compile_toc_data(
     #     for part in b_parts:
     #         part.page_id = f'B{part.page_id}'
 
-    charts.sort(key=lambda x: x.slug)
-    all_parts = a_parts + b_parts
+    # parts grouped by the slug of their chart, in the order they're found
+    chart_parts = {}
+    for part in a_parts + b_parts:
+        chart_parts.setdefault(part.slug, []).append(part)
 
     toc_data = []
 
-    for chart in charts:
-        for part in all_parts:
-            if chart.slug in part.slug:
-                songs_entry = []
-                if chart.is_single is False:
-                    for song in part.songs:
-                        songs_entry.append(song.title)
-                toc_data.append(
-                    [chart.title, part.part_title,
-                     f"{part.prefix}{part.page_id}",
-                     songs_entry]
-                     )
+    for chart in sorted(charts, key=lambda x: x.slug):
+        for part in chart_parts.get(chart.slug, []):
+            songs_entry = []
+            if chart.is_single is False:
+                for song in part.songs:
+                    songs_entry.append(song.title)
+            toc_data.append(
+                [chart.title, part.part_title,
+                 f"{part.prefix}{part.page_id}",
+                 songs_entry]
+                 )
 
     return toc_data
 
 
-def create_toc(
-        ensemble_name: str,
-        book_name: str,
-        format: str,
-        output_loc,
-        toc_data
-        ):
-    '''
-    Given the table of contents data, generates a table of contents
-    '''
-
+class TocLayout(NamedTuple):
+    """
+    The page size, margins, fonts, styles and frames of a table of contents
+    """
+    page_size: tuple[float, float]
+    margin_x: float
+    margin_top: float
+    margin_bottom: float
+    font_size: int
+    title_font_size: int
+    compact: bool
+    column_widths: list[int]
+    style_toc_title: ParagraphStyle
+    style_toc_h: ParagraphStyle
+    style_chart: ParagraphStyle
+    style_part: ParagraphStyle
+    style_id: ParagraphStyle
+    style_song: ParagraphStyle
+    columns: list[tuple[float, float, float, float]]
+    frames: list[Frame]
+
+
+class RenderedToc(NamedTuple):
+    """
+    A rendered table of contents pdf, and its number of pages
+    """
+    pdf: bytes
+    pages: int
+
+
+def toc_layout_name(format: str, layout: str = 'standard') -> str:
+    """
+    Returns the name of the table of contents layout used by a book format.
+    Every marchpack format shares one layout, and every binder format
+    shares another. A `compact` layout uses smaller type, and lists the
+    songs of a chart on one line, to fit more charts on each page.
+    """
+    if layout not in TOC_LAYOUTS:
+        raise ValueError(f'unknown table of contents layout {layout}')
     if format in MARCHPACK_FORMATS:
-        # page_format = "LYRE"
+        page_layout = 'marchpack'
+    elif format in BINDER_FORMATS:
+        page_layout = 'binder'
+    else:
+        raise ValueError(f'no table of contents layout for format {format}')
+    if layout == 'compact':
+        return f'{page_layout}-compact'
+    return page_layout
+
+
+@lru_cache(maxsize=None)
+def toc_layout(layout_name: str) -> TocLayout:
+    """
+    Builds the styles and frames of a table of contents layout,
+    once per layout
+    """
+    page_layout, _, mode = layout_name.partition('-')
+    compact = (mode == 'compact')
+    if page_layout == 'marchpack':
         page_size = (LYRE_PAPER_X, LYRE_PAPER_Y)
         margin_x = LYRE_MARGIN_X
         margin_top = LYRE_MARGIN_TOP
@@ -104,8 +156,7 @@ def create_toc(
         song_font_size = 7
         title_font_size = 14
         column_widths = [20, 145, 72]
-    elif format in BINDER_FORMATS:
-        # page_format = "PORTRAIT"
+    elif page_layout == 'binder':
         page_size = letter
         margin_x = LETTER_MARGIN_X
         margin_top = LETTER_MARGIN_Y
@@ -114,29 +165,23 @@ def create_toc(
         song_font_size = 10
         title_font_size = 24
         column_widths = [26, 160, 78]
+    leading = 1.2
 
-    toc_output = BytesIO()
+    if compact is True:
+        font_size -= 2
+        song_font_size -= 1
+        title_font_size -= 2
+        leading = 1.1
 
-    # toc_path = f"{output_loc}/toc.pdf"
-    doc = BaseDocTemplate(
-        toc_output,
-        pagesize=page_size,
-        rightMargin=margin_x,
-        leftMargin=margin_x,
-        topMargin=margin_top,
-        bottomMargin=margin_bottom,
-        title=f"Table of Contents - {book_name}"
-        )
-
-    style_title = getSampleStyleSheet()['Title']
+    stylesheet = getSampleStyleSheet()
 
     style_toc_title = ParagraphStyle(
         name='TOC Title',
-        parent=style_title,
+        parent=stylesheet['Title'],
         fontSize=title_font_size,
     )
 
-    style_cell = getSampleStyleSheet()['BodyText']
+    style_cell = stylesheet['BodyText']
     style_cell.alignment = TA_LEFT
 
     style_toc_h = ParagraphStyle(
@@ -144,40 +189,153 @@ def create_toc(
         parent=style_cell,
         fontName='Helvetica-Bold',
         fontSize=font_size,
-        leading=font_size*1.2
+        leading=font_size*leading
     )
 
     style_chart = ParagraphStyle(
         name='Chart Cell',
         parent=style_cell,
         fontSize=font_size,
-        leading=font_size*1.2
+        leading=font_size*leading
     )
 
     style_part = ParagraphStyle(
         name='Part Cell',
         parent=style_cell,
         fontSize=font_size,
-        leading=font_size*1.2
+        leading=font_size*leading
 
     )
 
     style_id = ParagraphStyle(
         name='ID Cell',
         fontSize=font_size,
-        leading=font_size*1.2
+        leading=font_size*leading
     )
 
     style_song = ParagraphStyle(
         name="Song Entry",
         parent=style_cell,
         fontSize=song_font_size,
-        leading=song_font_size*1.2,
+        leading=song_font_size*leading,
         leftIndent=8,
         bulletFontSize=song_font_size,
         bulletIndent=4
         )
 
+    # the same frames BaseDocTemplate would lay out for these margins,
+    # as (x, y, width, height)
+    width = page_size[0] - 2*margin_x
+    height = page_size[1] - margin_top - margin_bottom
+    columns = [
+        (
+            margin_x,
+            margin_bottom,
+            width/2-5,
+            height-(title_font_size*1.4)
+        ),
+        (
+            margin_x + width/2+5,
+            margin_bottom,
+            width/2-5,
+            height-(title_font_size*1.4)
+        )
+    ]
+    frames = [
+        Frame(*column, id=f'column{n}')
+        for n, column in enumerate(columns, start=1)
+    ]
+
+    return TocLayout(
+        page_size,
+        margin_x,
+        margin_top,
+        margin_bottom,
+        font_size,
+        title_font_size,
+        compact,
+        column_widths,
+        style_toc_title,
+        style_toc_h,
+        style_chart,
+        style_part,
+        style_id,
+        style_song,
+        columns,
+        frames
+        )
+
+
+def create_toc(
+        ensemble_name: str,
+        book_name: str,
+        format: str,
+        output_loc,
+        toc_data,
+        layout: str = 'standard',
+        renderer: str = 'platypus'
+        ) -> tuple[BytesIO, int]:
+    '''
+    Given the table of contents data, generates a table of contents,
+    which runs onto as many pages as it needs.
+    Books with the same title, layout and table of contents data share
+    one rendering, so each is only rendered once.
+    The `platypus` renderer lays the table out with reportlab's platypus,
+    and the `canvas` renderer draws the same table straight onto a canvas,
+    which is quicker.
+
+    Returns:
+        the table of contents pdf, and its number of pages
+    '''
+    toc_rows = tuple(
+        (entry[0], entry[1], entry[2], tuple(entry[3]))
+        for entry in toc_data
+    )
+    if renderer not in TOC_RENDERERS:
+        raise ValueError(f'unknown table of contents renderer {renderer}')
+    if renderer == 'canvas':
+        render = render_toc_canvas
+    else:
+        render = render_toc
+    toc = render(
+        ensemble_name,
+        book_name,
+        toc_layout_name(format, layout),
+        toc_rows
+        )
+    return BytesIO(toc.pdf), toc.pages
+
+
+@lru_cache(maxsize=64)
+def render_toc(
+        ensemble_name: str,
+        book_name: str,
+        layout_name: str,
+        toc_rows: tuple
+        ) -> RenderedToc:
+    '''
+    Renders a table of contents
+    '''
+    layout = toc_layout(layout_name)
+    font_size = layout.font_size
+    style_toc_h = layout.style_toc_h
+    style_chart = layout.style_chart
+    style_part = layout.style_part
+    style_id = layout.style_id
+    style_song = layout.style_song
+
+    toc_output = BytesIO()
+
+    doc = BaseDocTemplate(
+        toc_output,
+        pagesize=layout.page_size,
+        rightMargin=layout.margin_x,
+        leftMargin=layout.margin_x,
+        topMargin=layout.margin_top,
+        bottomMargin=layout.margin_bottom,
+        title=f"Table of Contents - {book_name}"
+        )
+
     toc_with_songs = [
         [
             Paragraph(
@@ -198,7 +356,8 @@ def create_toc(
     style = [('FONTNAME',       (0, 0), (-1, 0), 'Helvetica-Bold'),
              ('LEFTPADDING',    (0, 0), (-1, -1), 0),
              ('RIGHTPADDING',   (0, 0), (-1, -1), 0),
-             ('TOPPADDING',     (0, 0), (-1, -1), 2),
+             ('TOPPADDING',     (0, 0), (-1, -1),
+              1 if layout.compact else 2),
              ('BOTTOMPADDING',  (0, 0), (-1, -1), 0),
              ('LINEBELOW',      (0, 0), (-1, 0), 1, colors.black),
              ('VALIGN',         (0, 0), (-1, -1), 'MIDDLE'),
@@ -206,14 +365,25 @@ def create_toc(
 
     # height_rows = [16]
 
-    for entry in toc_data:
+    for entry in toc_rows:
         row_counter += 1
         # height_rows.append(16)
         toc_with_songs.append(
             [Paragraph(entry[2], style_id),
              Paragraph(entry[0], style_chart),
              Paragraph(entry[1], style_part)])
-        if entry[3] != []:
+        if entry[3] != () and layout.compact is True:
+            # every song of the chart on one line
+            row_counter += 1
+            style.append(
+                ('SPAN', (0, row_counter), (-1, row_counter))
+                )
+            toc_with_songs.append(
+                [Paragraph(
+                    '<i>' + ' &bull; '.join(entry[3]) + '</i>',
+                    style_song
+                    ), '', ''])
+        elif entry[3] != ():
             for song in entry[3]:
                 row_counter += 1
                 # height_rows.append(12)
@@ -229,26 +399,11 @@ def create_toc(
 
     toc = Table(
         toc_with_songs,
-        colWidths=column_widths,
+        colWidths=layout.column_widths,
         style=style,
         repeatRows=1
         )
 
-    frame1 = Frame(
-        doc.leftMargin,
-        doc.bottomMargin,
-        doc.width/2-5,
-        doc.height-(title_font_size*1.4),
-        id='column1'
-        )
-    frame2 = Frame(
-        doc.leftMargin + doc.width/2+5,
-        doc.bottomMargin,
-        doc.width/2-5,
-        doc.height-(title_font_size*1.4),
-        id='column2'
-        )
-
     def header(canvas, doc, content):
         canvas.saveState()
         w, h = content.wrap(doc.width, doc.topMargin)
@@ -257,7 +412,7 @@ def create_toc(
 
     toc_title = Paragraph(
         f"<b><i>{ensemble_name}: {book_name} Book</i></b>",
-        style_toc_title
+        layout.style_toc_title
         )
 
     elements = [toc]
@@ -265,7 +420,7 @@ def create_toc(
     doc.addPageTemplates(
         [PageTemplate(
             id='TOC',
-            frames=[frame1, frame2],
+            frames=layout.frames,
             onPage=partial(
                 header,
                 content=toc_title
@@ -275,4 +430,284 @@ def create_toc(
 
     doc.build(elements)
 
-    return toc_output
+    return RenderedToc(toc_output.getvalue(), doc.page)
+
+
+@lru_cache(maxsize=4096)
+def text_width(text: str, font_name: str, font_size: float) -> float:
+    """
+    Returns the width of a string in a font, caching the result
+    """
+    return stringWidth(text, font_name, font_size)
+
+
+def split_word(
+        word: str,
+        font_name: str,
+        font_size: float,
+        line_width: float,
+        start: float,
+        width: float
+        ) -> list[str]:
+    """
+    Splits a word too wide for its line between its characters, the way a
+    Paragraph does. The first piece fills the rest of a line `line_width`
+    wide that's already `start` full, and each other piece starts a new
+    line `width` wide.
+    """
+    pieces = []
+    piece = ''
+    piece_width = start
+    for char in word:
+        char_width = text_width(char, font_name, font_size)
+        if (piece_width + char_width > line_width
+                and (piece or char_width <= width)):
+            pieces.append(piece)
+            piece = ''
+            piece_width = 0
+            line_width = width
+        piece += char
+        piece_width += char_width
+    pieces.append(piece)
+    return pieces
+
+
+def wrap_text(
+        text: str,
+        font_name: str,
+        font_size: float,
+        width: float,
+        space_shrinkage: float = 0,
+        first_width: float = None
+        ) -> list[str]:
+    """
+    Breaks a string into lines no wider than `width`, or `first_width` for
+    the first line, between words, the way a Paragraph would. Like a
+    Paragraph, a line may run past its width by `space_shrinkage` of a
+    space for each space in it, and a word wider than its line is split.
+    """
+    if first_width is None:
+        first_width = width
+    space = text_width(' ', font_name, font_size)
+    lines = []
+    line = []
+    line_width = 0
+    # each word, and whether it's a piece of a word that was split
+    words = [(word, False) for word in text.split()]
+    while words:
+        word, is_piece = words.pop(0)
+        word_width = text_width(word, font_name, font_size)
+        max_width = width if lines else first_width
+        start = line_width + space if line else 0
+        limit = max_width + space_shrinkage * space * len(line)
+        if (start + word_width > limit and not is_piece
+                and word_width > max_width):
+            pieces = split_word(
+                word, font_name, font_size, max_width, start, width
+                )
+            line.append(pieces[0])
+            lines.append(' '.join(line))
+            line = []
+            line_width = 0
+            words[0:0] = [(piece, True) for piece in pieces[1:]]
+            continue
+        if line and start + word_width > limit:
+            lines.append(' '.join(line))
+            line = []
+            start = 0
+        line.append(word)
+        line_width = start + word_width
+    if line or not lines:
+        lines.append(' '.join(line))
+    return lines
+
+
+class TocCell(NamedTuple):
+    """
+    The lines of text in a table of contents cell, and how they're drawn
+    """
+    lines: list[str]
+    font_name: str
+    font_size: float
+    leading: float
+    indent: float = 0
+    bullet: str = None
+    first_indent: float = None
+
+
+@lru_cache(maxsize=64)
+def render_toc_canvas(
+        ensemble_name: str,
+        book_name: str,
+        layout_name: str,
+        toc_rows: tuple
+        ) -> RenderedToc:
+    '''
+    Renders a table of contents by drawing its rows straight onto a
+    canvas, with the same columns, page breaks and song bullets as
+    render_toc
+    '''
+    layout = toc_layout(layout_name)
+    page_x, page_y = layout.page_size
+    column_widths = layout.column_widths
+    table_width = sum(column_widths)
+    padding = 1 if layout.compact else 2
+    head = layout.style_toc_h
+    song = layout.style_song
+
+    def cell(text: str, style: ParagraphStyle, width: float,
+             font_name: str = None) -> TocCell:
+        font_name = font_name or style.fontName
+        return TocCell(
+            wrap_text(text, font_name, style.fontSize, width,
+                      style.spaceShrinkage),
+            font_name,
+            style.fontSize,
+            style.leading
+            )
+
+    def song_cell(text: str, bullet: str = None) -> TocCell:
+        indent = song.leftIndent
+        first_indent = indent
+        if bullet is not None:
+            # a Paragraph moves its first line past the bullet if they'd
+            # overlap
+            first_indent = max(
+                indent,
+                song.bulletIndent + 0.6 * song.fontSize
+                + text_width(bullet, 'Helvetica', song.fontSize)
+                )
+        return TocCell(
+            wrap_text(
+                text,
+                'Helvetica-Oblique',
+                song.fontSize,
+                table_width - indent,
+                song.spaceShrinkage,
+                table_width - first_indent
+                ),
+            'Helvetica-Oblique',
+            song.fontSize,
+            song.leading,
+            indent,
+            bullet,
+            first_indent
+            )
+
+    # each row is its top padding, the least height of its contents, and
+    # its cells, or a single cell spanning the table. A Table gives the
+    # empty cells under a span the height of one line of 12 point leading.
+    header_row = (padding, 0, [
+        cell(text, head, width)
+        for text, width in zip(('##', 'CHART', 'PART'), column_widths)
+    ])
+    rows = []
+    for entry in toc_rows:
+        rows.append((padding, 0, [
+            cell(entry[2], layout.style_id, column_widths[0]),
+            cell(entry[0], layout.style_chart, column_widths[1]),
+            cell(entry[1], layout.style_part, column_widths[2])
+        ]))
+        if entry[3] != () and layout.compact is True:
+            rows.append((
+                padding,
+                12,
+                [song_cell(' \u2022 '.join(entry[3]))]
+                ))
+        elif entry[3] != ():
+            for song_title in entry[3]:
+                rows.append((1, 12, [song_cell(song_title, '\u2022')]))
+
+    def row_height(row) -> float:
+        top_padding, min_height, cells = row
+        return top_padding + max(
+            [min_height] + [len(c.lines) * c.leading for c in cells]
+            )
+
+    toc_output = BytesIO()
+    pdf = canvas.Canvas(toc_output, pagesize=layout.page_size)
+    pdf.setTitle(f"Table of Contents - {book_name}")
+
+    title = layout.style_toc_title
+    doc_width = page_x - 2 * layout.margin_x
+    doc_height = page_y - layout.margin_top - layout.margin_bottom
+    title_lines = wrap_text(
+        f"{ensemble_name}: {book_name} Book",
+        'Helvetica-BoldOblique',
+        title.fontSize,
+        doc_width,
+        title.spaceShrinkage
+        )
+
+    def draw_title():
+        # where render_toc's header draws its title paragraph, whose first
+        # baseline is a font size below the paragraph's top
+        title_height = len(title_lines) * title.leading
+        bottom = doc_height + layout.margin_top - title_height
+        y = bottom + title_height - title.fontSize
+        pdf.setFont('Helvetica-BoldOblique', title.fontSize)
+        for line in title_lines:
+            pdf.drawCentredString(page_x / 2, y, line)
+            y -= title.leading
+
+    def draw_row(row, x: float, top: float):
+        top_padding, min_height, cells = row
+        height = row_height(row)
+        if len(cells) == 1:
+            widths = [table_width]
+        else:
+            widths = column_widths
+        for c, width in zip(cells, widths):
+            # cells are centered vertically in their row
+            content = len(c.lines) * c.leading
+            y = top - top_padding - (height - top_padding - content) / 2
+            y -= c.font_size
+            if c.bullet is not None:
+                pdf.setFont('Helvetica', c.font_size)
+                pdf.drawString(x + song.bulletIndent, y, c.bullet)
+            pdf.setFont(c.font_name, c.font_size)
+            indent = c.indent if c.first_indent is None else c.first_indent
+            for line in c.lines:
+                pdf.drawString(x + indent, y, line)
+                y -= c.leading
+                indent = c.indent
+            x += width
+
+    def draw_header(x: float, top: float) -> float:
+        draw_row(header_row, x, top)
+        bottom = top - row_height(header_row)
+        pdf.setLineWidth(1)
+        pdf.line(x, bottom, x + table_width, bottom)
+        return bottom
+
+    def start_column(n: int) -> tuple[float, float, float, float]:
+        # frames pad their contents by 6 points, and center the table
+        column_x, column_y, width, height = layout.columns[n]
+        x = column_x + 6 + (width - 12 - table_width) / 2
+        top = column_y + height - 6
+        available = top - (column_y + 6)
+        return x, draw_header(x, top), available, row_height(header_row)
+
+    pages = 1
+    column = 0
+    draw_title()
+    x, top, available, used = start_column(column)
+    for row in rows:
+        height = row_height(row)
+        # adding up the heights the way a Table does when it splits keeps
+        # rows that only just fit in the same column
+        if used + height > available:
+            column += 1
+            if column == len(layout.columns):
+                pdf.showPage()
+                pages += 1
+                column = 0
+                draw_title()
+            x, top, available, used = start_column(column)
+        draw_row(row, x, top)
+        top -= height
+        used += height
+    pdf.showPage()
+    pdf.save()
+
+    return RenderedToc(toc_output.getvalue(), pages)
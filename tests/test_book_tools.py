@@ -0,0 +1,124 @@
+"""
+Checks how books are planned (see magicbook.book_tools.plan_books).
+"""
+
+import os
+import tempfile
+import unittest
+
+from magicbook.book_tools import assemble_books, build_plan, plan_books
+from magicbook.constants import INDEX_FILENAME, SPLITSORT
+from magicbook.index_tools import update_index
+from magicbook.library_tools import Chart, ChartParts
+
+
+def fight_song() -> Chart:
+    return Chart(
+        'fight-song',
+        True,
+        [{'title': 'Fight Song', 'artist': 'Artist', 'arranger': 'Arranger'}]
+        )
+
+
+class TestPlanBooks(unittest.TestCase):
+
+    def setUp(self):
+        self.charts = [fight_song()]
+        self.listings = {
+            'fight-song': ChartParts('fight-song', [
+                'fight-song LYRE trumpet1.pdf',
+                'fight-song PORTRAIT trumpet1.pdf',
+                'fight-song LYRE tuba.pdf'
+            ])
+        }
+
+    def plan_instrument(self, instrument: dict) -> dict:
+        plan = plan_books(self.charts, [instrument], self.listings, SPLITSORT)
+        return plan['instruments'][0]['charts'][0]
+
+    def test_own_parts(self):
+        chart = self.plan_instrument(
+            {'slug': 'trumpet', 'name': 'Trumpet', 'div': 1}
+            )
+        self.assertEqual(chart['source'], 'trumpet')
+        self.assertEqual(chart['parts'], 1)
+        self.assertEqual(
+            sorted(file['file'] for file in chart['files']),
+            ['fight-song LYRE trumpet1.pdf',
+             'fight-song PORTRAIT trumpet1.pdf']
+            )
+
+    def test_alternate_parts(self):
+        chart = self.plan_instrument({
+            'slug': 'bassguitar',
+            'name': 'Bass Guitar',
+            'div': 1,
+            'alternates': ['baritonebc', 'tuba']
+            })
+        self.assertEqual(chart['source'], 'tuba')
+        self.assertEqual(
+            [file['file'] for file in chart['files']],
+            ['fight-song LYRE tuba.pdf']
+            )
+
+    def test_no_alternates(self):
+        # an instrument without an alternates list is only missing its parts
+        chart = self.plan_instrument(
+            {'slug': 'altosax', 'name': 'Alto Sax', 'div': 1}
+            )
+        self.assertIsNone(chart['source'])
+        self.assertEqual(chart['parts'], 0)
+        self.assertEqual(chart['files'], [])
+
+
+class TestBuildPlan(unittest.TestCase):
+
+    def test_parts_added_after_indexing(self):
+        trumpet = {'slug': 'trumpet', 'name': 'Trumpet', 'div': 1}
+        with tempfile.TemporaryDirectory() as lib_dir:
+            os.mkdir(os.path.join(lib_dir, 'fight-song'))
+            update_index(lib_dir, [fight_song()])
+            index_mtime = os.stat(os.path.join(lib_dir, INDEX_FILENAME))
+            # the part isn't read while planning, so it can be empty
+            part = os.path.join(lib_dir, 'fight-song', 'fight-song LYRE '
+                                'trumpet1.pdf')
+            open(part, 'w').close()
+
+            plan = build_plan(
+                [{1: fight_song()}], lib_dir, [trumpet], SPLITSORT
+                )
+            self.assertEqual(
+                os.stat(os.path.join(lib_dir, INDEX_FILENAME)).st_mtime_ns,
+                index_mtime.st_mtime_ns
+                )
+
+        chart = plan['instruments'][0]['charts'][0]
+        self.assertEqual(chart['source'], 'trumpet')
+        self.assertEqual(
+            [file['file'] for file in chart['files']],
+            ['fight-song LYRE trumpet1.pdf']
+            )
+
+
+class TestAssembleBooks(unittest.TestCase):
+
+    def test_unknown_staging_mode(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            output_dir = os.path.join(tmp, 'output')
+            with self.assertRaises(ValueError):
+                assemble_books(
+                    [{1: fight_song()}],
+                    os.path.join(tmp, 'library'),
+                    output_dir,
+                    [{'slug': 'trumpet', 'name': 'Trumpet', 'div': 1}],
+                    'marching-band',
+                    'Marching Band',
+                    (False, -1, False),
+                    SPLITSORT,
+                    staging='teleport'
+                    )
+            self.assertFalse(os.path.exists(output_dir))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+"""
+Checks how marchpack charts are split between the A and B sides
+(see magicbook.imposition_tools.balance_sides).
+"""
+
+import unittest
+
+from magicbook.imposition_tools import (
+    auto_order_charts,
+    balance_sides,
+    split_sides
+)
+from magicbook.library_tools import Chart
+
+
+def charts(n: int) -> list[Chart]:
+    return [
+        Chart(
+            f'chart-{i}',
+            True,
+            [{'title': f'Chart {i}', 'artist': None, 'arranger': None}]
+            )
+        for i in range(1, n + 1)
+    ]
+
+
+def slugs(index: dict) -> dict[int, str]:
+    return {chart_id: chart.slug for chart_id, chart in index.items()}
+
+
+class TestBalanceSides(unittest.TestCase):
+
+    def test_even_split(self):
+        self.assertEqual(balance_sides([1, 1, 1, 1]), (2, 0))
+        self.assertEqual(balance_sides([1, 1, 1, 1], 99), (2, 0))
+
+    def test_longer_b_side(self):
+        # an even split puts the table of contents and all three long
+        # charts on the A side, so the B side should take more charts
+        pages = [5, 5, 5, 1, 1, 1]
+        self.assertEqual(balance_sides(pages), (2, 5))
+        self.assertEqual(balance_sides(pages, 99), (2, 5))
+
+    def test_longer_a_side(self):
+        self.assertEqual(balance_sides([1, 1, 1, 1, 4, 4], 99), (4, 1))
+
+    def test_odd_count(self):
+        self.assertEqual(balance_sides([1, 1, 1, 1, 1]), (2, 0))
+        self.assertEqual(balance_sides([4, 1, 1, 1, 1], 99), (1, 1))
+
+    def test_minimum_max_id(self):
+        # the B side is numbered up to max_id, so it can't have more charts
+        self.assertEqual(balance_sides([5, 5, 5, 1, 1, 1], 3), (3, 0))
+        self.assertEqual(balance_sides([4, 1, 1, 1, 1], 3), (2, 0))
+        self.assertEqual(balance_sides([4, 1, 1, 1, 1], 4), (1, 1))
+
+
+class TestSplitSides(unittest.TestCase):
+
+    def test_b_side_ends_at_max_id(self):
+        a_index, b_index = split_sides(charts(6), 2, 10)
+        self.assertEqual(slugs(a_index), {1: 'chart-1', 2: 'chart-2'})
+        self.assertEqual(
+            slugs(b_index),
+            {7: 'chart-3', 8: 'chart-4', 9: 'chart-5', 10: 'chart-6'}
+            )
+
+    def test_odd_count_minimum_max_id(self):
+        # A and B IDs may overlap, as their prefixes tell them apart
+        a_index, b_index = split_sides(charts(5), 2, 3)
+        self.assertEqual(slugs(a_index), {1: 'chart-1', 2: 'chart-2'})
+        self.assertEqual(
+            slugs(b_index),
+            {1: 'chart-3', 2: 'chart-4', 3: 'chart-5'}
+            )
+
+    def test_auto_order_without_max_id(self):
+        pages = {'chart-1': 5, 'chart-2': 5, 'chart-3': 5}
+        a_index, b_index = auto_order_charts(charts(6), True, pages)
+        self.assertEqual(slugs(a_index), {1: 'chart-1', 2: 'chart-2'})
+        self.assertEqual(
+            slugs(b_index),
+            {1: 'chart-3', 2: 'chart-4', 3: 'chart-5', 4: 'chart-6'}
+            )
+
+
+if __name__ == '__main__':
+    unittest.main()
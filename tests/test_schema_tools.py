@@ -0,0 +1,139 @@
+"""
+Checks that the generated chart validator gives the same verdict as
+jsonschema for valid and invalid info.json data
+(see magicbook.schema_tools).
+"""
+
+import json
+import os
+import random
+import tempfile
+import unittest
+
+import jsonschema
+
+from magicbook.constants import DEFAULT_SCHEMA
+from magicbook.schema_tools import ChartValidator, compile_fast_validator
+
+
+def song(title='Fight Song', artist='Artist', arranger='Arranger') -> dict:
+    return {'title': title, 'artist': artist, 'arranger': arranger}
+
+
+SAMPLE_INFO = [
+    # valid
+    {'slug': 'fight-song', 'songs': [song()]},
+    {'slug': 'medley', 'title': 'Medley',
+     'songs': [song('One'), song('Two'), song('Three')]},
+    {'slug': 'fight-song', 'is_single': True, 'songs': [song()]},
+    {'slug': 'fight-song', 'songs': [{}]},
+    {'slug': 'fight-song', 'songs': [{'title': 'Fight Song'}]},
+    {'slug': 'fight-song', 'songs': [song(), {'title': 'Fight Song'}]},
+    {'slug': 'fight-song', 'songs': [{'title': 'One', 'key': 'Bb'}]},
+    {'slug': 'fight-song', 'songs': [{'title': True}, {'title': 1}]},
+    {'slug': '', 'songs': [song('')]},
+    # invalid
+    {},
+    {'slug': 'fight-song'},
+    {'songs': [song()]},
+    {'slug': 'fight-song', 'songs': []},
+    {'slug': 'fight-song', 'songs': [song(), song()]},
+    {'slug': 'fight-song', 'songs': {'title': 'Fight Song'}},
+    {'slug': 'fight-song', 'songs': ['Fight Song']},
+    {'slug': 'fight-song', 'songs': [None]},
+    {'slug': 'fight-song', 'songs': [song(title=None)]},
+    {'slug': 'fight-song', 'songs': [song(artist=1)]},
+    {'slug': 'fight-song', 'songs': [song(arranger=['Arranger'])]},
+    {'slug': 1, 'songs': [song()]},
+    {'slug': None, 'songs': [song()]},
+    {'slug': 'fight-song', 'title': False, 'songs': [song()]},
+    [{'slug': 'fight-song', 'songs': [song()]}],
+    'fight-song',
+    None,
+]
+
+VALUES = (
+    None, True, False, 0, 1, 1.0, 1.5, '', 'Fight Song', [], {}, ['Fight Song']
+)
+
+
+def random_info(rng: random.Random) -> dict:
+    """
+    Returns chart info with each value either right, of the wrong type or
+    left out, and songs that may be missing, empty or repeated
+    """
+    def value():
+        if rng.random() < 0.6:
+            return rng.choice(['Fight Song', 'Medley', ''])
+        return rng.choice(VALUES)
+
+    def random_song():
+        if rng.random() < 0.1:
+            return rng.choice(VALUES)
+        return {
+            key: value()
+            for key in ('title', 'artist', 'arranger')
+            if rng.random() < 0.8
+        }
+
+    info = {}
+    for key in ('slug', 'title'):
+        if rng.random() < 0.8:
+            info[key] = value()
+    if rng.random() < 0.9:
+        songs = [random_song() for n in range(rng.randint(0, 3))]
+        if songs != [] and rng.random() < 0.2:
+            songs.append(songs[0])
+        info['songs'] = songs if rng.random() < 0.9 else rng.choice(VALUES)
+    return info
+
+
+class TestChartValidator(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.samples = SAMPLE_INFO + [
+            random_info(random.Random(seed)) for seed in range(500)
+        ]
+        cls.jsonschema_validator = jsonschema.Draft202012Validator(
+            DEFAULT_SCHEMA
+            )
+        cls.tmp = tempfile.TemporaryDirectory()
+        cls.scmpath = os.path.join(cls.tmp.name, 'chart-info.json')
+        with open(cls.scmpath, 'w') as schema:
+            json.dump(DEFAULT_SCHEMA, schema)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmp.cleanup()
+
+    def test_samples_cover_both_verdicts(self):
+        verdicts = {
+            self.jsonschema_validator.is_valid(info) for info in self.samples
+        }
+        self.assertEqual(verdicts, {True, False})
+
+    def test_fast_validator(self):
+        fast_validate = compile_fast_validator(DEFAULT_SCHEMA)
+        for info in self.samples:
+            with self.subTest(info=info):
+                self.assertEqual(
+                    fast_validate(info),
+                    self.jsonschema_validator.is_valid(info)
+                    )
+
+    def test_fast_path(self):
+        fast = ChartValidator(self.scmpath)
+        full = ChartValidator(self.scmpath, fast_path=False)
+        for info in self.samples:
+            with self.subTest(info=info):
+                error = fast.validate(info)
+                self.assertEqual(error, full.validate(info))
+                self.assertEqual(
+                    error is None,
+                    self.jsonschema_validator.is_valid(info)
+                    )
+
+
+if __name__ == '__main__':
+    unittest.main()
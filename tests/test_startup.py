@@ -0,0 +1,96 @@
+"""
+Checks that the commands that should start quickly exit successfully
+without importing any of magicbook's heavy dependencies
+(see magicbook.startup_benchmark).
+"""
+
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+from magicbook.startup_benchmark import (
+    cheap_commands,
+    parse_importtime,
+    startup_problems,
+    time_command
+)
+
+# import time depends on the machine, so only the other checks are tested
+NO_BUDGET = float('inf')
+
+
+class TestStartup(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp = tempfile.TemporaryDirectory()
+        cls.library = os.path.join(cls.tmp.name, 'library')
+        subprocess.run(
+            [sys.executable, '-m', 'magicbook', '--path', cls.library, 'new'],
+            stdout=subprocess.DEVNULL,
+            check=True
+            )
+        chart_dir = os.path.join(cls.library, 'music-library', 'fight-song')
+        os.makedirs(chart_dir)
+        with open(os.path.join(chart_dir, 'info.json'), 'w') as info:
+            json.dump({
+                'slug': 'fight-song',
+                'is_single': True,
+                'songs': [{
+                    'title': 'Fight Song',
+                    'artist': 'Artist',
+                    'arranger': 'Arranger'
+                }]
+            }, info)
+        # the first audit validates the chart, which does need jsonschema,
+        # and fills the audit cache the measured runs are answered from
+        subprocess.run(
+            [sys.executable, '-m', 'magicbook',
+             '--path', cls.library, 'charts', 'audit'],
+            stdout=subprocess.DEVNULL,
+            check=True
+            )
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmp.cleanup()
+
+    def test_cheap_commands(self):
+        for name, command in cheap_commands(self.library).items():
+            with self.subTest(command=name):
+                timing = time_command(command, runs=1)
+                self.assertEqual(timing.returncode, 0)
+                self.assertEqual(startup_problems(timing, NO_BUDGET), [])
+
+    def test_failed_command(self):
+        timing = time_command([], runs=1, module='magicbook.no_such_module')
+        self.assertNotEqual(timing.returncode, 0)
+        self.assertIn(
+            f'exited with status {timing.returncode}',
+            startup_problems(timing, NO_BUDGET)
+            )
+
+    def test_missing_report(self):
+        self.assertIn(
+            'no import time report was found',
+            startup_problems(parse_importtime(''), NO_BUDGET)
+            )
+
+    def test_heavy_module(self):
+        timing = parse_importtime(
+            'import time: self [us] | cumulative | imported package\n'
+            'import time:       100 |        100 |   pypdf._page\n'
+            'import time:       200 |        300 | pypdf\n'
+            )
+        self.assertEqual(timing.total_us, 300)
+        self.assertIn(
+            'imports heavy modules: pypdf',
+            startup_problems(timing, NO_BUDGET)
+            )
+
+
+if __name__ == '__main__':
+    unittest.main()
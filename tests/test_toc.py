@@ -0,0 +1,171 @@
+"""
+Checks that the canvas table of contents renderer lays out every layout
+the same as the platypus renderer, and that it is quicker
+(see magicbook.toc_tools).
+"""
+
+import random
+import timeit
+import unittest
+
+import pypdf
+
+from magicbook.constants import (
+    BINDER_FORMATS,
+    MARCHPACK_FORMATS,
+    TOC_LAYOUTS
+)
+from magicbook.toc_tools import (
+    create_toc,
+    render_toc,
+    render_toc_canvas,
+    toc_layout_name
+)
+
+WORDS = (
+    'the march of a grand old fight song medley anthem for band with '
+    'extra long titles and many words in it supercalifragilisticexpialidocious'
+).split() + ['W' * 30]
+
+PARTS = ('Trumpet 1', 'Bb Clarinet', 'Baritone Treble Clef Part 2')
+
+
+def title(rng: random.Random, words: int) -> str:
+    return ' '.join(rng.choice(WORDS).capitalize() for n in range(words))
+
+
+def sample_toc_data(seed: int) -> list[list]:
+    """
+    Returns table of contents data long enough to run onto several pages,
+    with titles that wrap, words too long for their column, and charts
+    with no songs, one song, or several
+    """
+    rng = random.Random(seed)
+    toc_data = []
+    for n in range(1, 200):
+        songs = [
+            title(rng, rng.randint(1, 9))
+            for song in range(rng.choice([0, 0, 0, 1, 3, 6]))
+        ]
+        toc_data.append([
+            title(rng, rng.randint(1, 8)),
+            rng.choice(PARTS),
+            f"{'AB'[n % 2]}{n % 100}",
+            songs
+        ])
+    return toc_data
+
+
+def text_positions(pdf) -> list[list[tuple]]:
+    """
+    Returns the position and text of everything drawn on each page of a
+    pdf, in reading order
+    """
+    pages = []
+    for page in pypdf.PdfReader(pdf).pages:
+        items = []
+
+        def visit(text, cm, tm, font_dict, font_size):
+            if text.strip() != '':
+                matrix = pypdf.mult(tm, cm)
+                items.append(
+                    (round(matrix[4], 2), round(matrix[5], 2), text.strip())
+                    )
+
+        page.extract_text(visitor_text=visit)
+        pages.append(sorted(items, key=lambda item: (-item[1], item[0])))
+    return pages
+
+
+class TestTocRenderers(unittest.TestCase):
+
+    def assertSameLayout(self, ensemble_name, format, layout, toc_data):
+        platypus_pdf, platypus_pages = create_toc(
+            ensemble_name, 'Trumpet', format, None, toc_data,
+            layout=layout, renderer='platypus'
+            )
+        canvas_pdf, canvas_pages = create_toc(
+            ensemble_name, 'Trumpet', format, None, toc_data,
+            layout=layout, renderer='canvas'
+            )
+        self.assertEqual(canvas_pages, platypus_pages)
+        platypus_text = text_positions(platypus_pdf)
+        canvas_text = text_positions(canvas_pdf)
+        self.assertEqual(len(canvas_text), platypus_pages)
+        for page, (expected, drawn) in enumerate(
+                zip(platypus_text, canvas_text), start=1):
+            with self.subTest(page=page):
+                self.assertEqual(drawn, expected)
+
+    def test_layouts(self):
+        for format in (MARCHPACK_FORMATS[-1], BINDER_FORMATS[0]):
+            for layout in TOC_LAYOUTS:
+                for seed in range(3):
+                    with self.subTest(format=format, layout=layout,
+                                      seed=seed):
+                        self.assertSameLayout(
+                            'Marching Band', format, layout,
+                            sample_toc_data(seed)
+                            )
+
+    def test_long_title(self):
+        # a title too long for one line wraps onto more
+        for format in (MARCHPACK_FORMATS[-1], BINDER_FORMATS[0]):
+            with self.subTest(format=format):
+                self.assertSameLayout(
+                    'The Extraordinarily Long Named Marching Band Of The '
+                    'University Of Somewhere Or Other',
+                    format, 'standard', sample_toc_data(0)[:20]
+                    )
+
+    def test_short_toc(self):
+        for format in (MARCHPACK_FORMATS[-1], BINDER_FORMATS[0]):
+            for layout in TOC_LAYOUTS:
+                with self.subTest(format=format, layout=layout):
+                    self.assertSameLayout(
+                        'Marching Band', format, layout,
+                        [['Fight Song', 'Trumpet 1', 'A1', []]]
+                        )
+
+
+# Fastest of 5 renders of sample_toc_data(0), in ms (platypus / canvas):
+#
+#   format                  layout     10 charts     199 charts
+#   MarchpackComprehensive  standard   22.3 / 5.4    660.6 / 87.3
+#   MarchpackComprehensive  compact    16.9 / 4.4    460.0 / 56.1
+#   BinderOnePartPg         standard   17.5 / 5.2    624.5 / 84.4
+#   BinderOnePartPg         compact    16.8 / 4.3    414.2 / 59.9
+#
+# Times depend on the machine, so the test only checks that the canvas
+# renderer is the quicker one.
+class TestTocSpeed(unittest.TestCase):
+
+    def render_ms(self, render, format, layout, toc_rows) -> float:
+        # the renderers' caches are skipped, so every render is timed
+        return 1000 * min(timeit.repeat(
+            lambda: render.__wrapped__(
+                'Marching Band', 'Trumpet',
+                toc_layout_name(format, layout), toc_rows
+                ),
+            number=1,
+            repeat=5
+            ))
+
+    def test_canvas_is_quicker(self):
+        toc_rows = tuple(
+            (entry[0], entry[1], entry[2], tuple(entry[3]))
+            for entry in sample_toc_data(0)[:20]
+        )
+        for format in (MARCHPACK_FORMATS[-1], BINDER_FORMATS[0]):
+            for layout in TOC_LAYOUTS:
+                with self.subTest(format=format, layout=layout):
+                    self.assertLess(
+                        self.render_ms(
+                            render_toc_canvas, format, layout, toc_rows
+                            ),
+                        self.render_ms(render_toc, format, layout, toc_rows)
+                        )
+
+
+if __name__ == '__main__':
+    unittest.main()